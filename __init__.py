@@ -1,14 +1,28 @@
 """pacder"""
+from asyncio import gather
+from contextlib import closing
+from io import BytesIO
 from json import (loads as json_loads, dumps as json_dumps)
 from logging import getLogger
 from queue import Queue
 
-from .connector import Connector
-from .metadata import Metadata
-from .record import Field, Record
+from .connector import (
+    AsyncConnector, Connector, ConnectorPool, ImportJob
+)
+from .metadata import COLUMNS, BranchingLogic, Metadata, MetadataCache
+from .metrics import RequestMetrics
+from .mirror import Mirror
+from .record import diff_records, numpy_columns, Record, RecordFrame
+from .sync import sync_key, SyncStore
+from .util import CHUNK_SIZE, data_type_map, iter_csv_rows, iter_json_array
 
 
-__all__ = ["Connector", "Metadata", "Project", "Record",]
+__all__ = [
+    "AsyncConnector", "AsyncProject", "BranchingLogic", "Connector",
+    "ConnectorPool", "diff_records", "ImportJob", "Metadata",
+    "MetadataCache", "Mirror", "Project", "Record", "RecordFrame",
+    "RequestMetrics", "SyncStore",
+]
 
 
 LOGGER = getLogger(__name__) # TODO: logging
@@ -23,8 +37,6 @@ class Project:
 
     def __enter__(self):
         """enter context"""
-        if self.connector.sock is None:
-            self.connector.connect()
         return self
 
     def __exit__(self, typ, val, trb):
@@ -38,39 +50,240 @@ class Project:
                 if not kwargs:
                     return proj.metadata
         elif key == "record":
-            def closed(proj=self, **kwargs):
+            def closed(
+                proj=self, stream=False, frame=False, numpy=False,
+                workers=None, sync=None, **kwargs
+            ):
+                if sync is not None:
+                    if kwargs:
+                        raise Exception(
+                            "can't sync with export parameters: {}".format(
+                                ", ".join(sorted(kwargs))
+                            )
+                        )
+                    return [
+                        proj.record_cls(r) for r in proj.sync_records(sync)
+                    ]
+                if numpy:
+                    return proj.record_arrays(**kwargs)
+                if frame:
+                    return proj.record_frame(**kwargs)
+                if stream:
+                    return proj.iter_records(**kwargs)
                 with proj.connector as conn:
-                    records = conn.records("export", **kwargs)
-                return [
-                    Record(r, project=proj)
-                    for r in json_loads(records)
-                ]
+                    if workers:
+                        records = conn.export_partitioned(
+                            workers=workers,
+                            record_id=next(iter(proj.metadata.field_map)),
+                            **kwargs
+                        )
+                    else:
+                        records = conn.records("export", **kwargs)
+                return proj.load_records(records, kwargs)
         return closed
 
     def __init__(self, host, path, token, **kwargs):
-        """constructor"""
+        """constructor; with `lazy`, metadata loads on first use"""
         try:
-            self.connector = Connector(host, path, token)
-            self.metadata = Metadata(project=self)
+            self.connector = ConnectorPool(
+                host, path, token, size=kwargs.pop("pool_size", 4),
+                **{
+                    k: kwargs.pop(k, None) for k in (
+                        "instrument", "retry_policy", "rate_limiter",
+                        "compress_requests",
+                    )
+                }
+            )
+            self.location = (host, path, token)
+            self.cache = kwargs.pop("cache", None)
+            self.lazy = kwargs.pop("lazy", False)
+            self.metadata_parameters = {
+                k: kwargs.pop(k) for k in ("forms", "fields") if k in kwargs
+            }
+            self._metadata = self._record_cls = None
+            if not self.lazy:
+                self.load_metadata()
         except: raise # logging etc
         else:
-            Record.project = self
-            field_desc = Field()
-            for field in self.metadata.field_map:
-                setattr(Record, field, field_desc)
-                field_desc.__set_name__(Record, field)
-            self.record_cls = Record
+            if not self.lazy:
+                self.build_record_cls()
 
     def __setitem__(self, key, value):
         """send (import) project resource"""
-        if isinstance(value, (list, tuple, set)):
-            value = "[" + ", ".join(str(r) for r in value) + "]"
+        if key == "record":
+            if not isinstance(value, (list, tuple, set)):
+                value = [value]
+            job = self.import_records(value)
+            if job.errors:
+                raise Exception(
+                    "failed to import batches {}".format(sorted(job.errors))
+                )
+
+    @property
+    def metadata(self):
+        """return project metadata, loading it if needed"""
+        if self._metadata is None:
+            self.load_metadata()
+        return self._metadata
+
+    @metadata.setter
+    def metadata(self, metadata):
+        """replace project metadata"""
+        self._metadata = metadata
+        self._record_cls = None
+
+    @property
+    def record_cls(self):
+        """return this project's Record class, generating it if needed"""
+        if self._record_cls is None:
+            self.build_record_cls()
+        return self._record_cls
+
+    def build_record_cls(self):
+        """generate this project's Record class from self.metadata"""
+        self._record_cls = Record.for_project(self, lazy=self.lazy)
+
+    def load_metadata(self):
+        """fetch metadata, from self.cache when one is configured"""
+        if self.cache is not None:
+            raw_metadata, field_names = self.cache.fetch(
+                self.connector, *self.location, **self.metadata_parameters
+            )
+            self.metadata = Metadata(
+                raw_metadata, field_names=field_names, project=self
+            )
         else:
-            value = "[" + str(value) + "]"
-            
+            self.metadata = Metadata(
+                project=self, **self.metadata_parameters
+            )
+
     def close(self):
         """clean up self"""
-        pass
+        self.connector.close()
+
+    def import_records(
+        self, records, batch_size=500, workers=4, job=None, dirty=False,
+        **kwargs
+    ):
+        """import records in concurrent batches, resuming `job` if given
+
+        With `dirty`, only Records with dirty fields are sent, each as
+        its keys plus dirty fields, with overwriteBehavior=overwrite so
+        that blanked fields are cleared. The rows are fixed on the job's
+        first run, so a resumed job sends the same batches, and each
+        Record is cleaned of the fields its completed batch sent.
+        """
+        if dirty:
+            kwargs.setdefault("overwriteBehavior", "overwrite")
+        if job is None:
+            job = ImportJob(
+                self.connector, batch_size=batch_size, workers=workers,
+                **kwargs
+            )
+        if not dirty:
+            job.run(r.raw() if isinstance(r, Record) else r for r in records)
+            return job
+        if job.pairs is None:
+            job.pairs = [
+                (r, r.changes()) if isinstance(r, Record) else (None, r)
+                for r in records if not isinstance(r, Record) or r.dirty
+            ]
+        completed = set(job.completed)
+        job.run(row for _, row in job.pairs)
+        for index in job.completed - completed:
+            for r, row in job.pairs[
+                index * job.batch_size:(index + 1) * job.batch_size
+            ]:
+                if r is not None:
+                    r.clean(row)
+        return job
+
+    def csv_records(self, resp, delimiter=",", decimal=None):
+        """yield raw records of a CSV export as its rows arrive"""
+        rows = iter_csv_rows(resp, delimiter)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [] # (position, field, decimal comma to fix)
+        for i, field in enumerate(header):
+            if field in self.metadata.field_map:
+                data_type = self.metadata[field][COLUMNS[7]]
+                columns.append((i, field, (
+                    decimal == "comma" and "comma" not in data_type
+                    and data_type_map.get(data_type, ("", "", ""))[2]
+                    == "FLOAT"
+                )))
+            elif field in self.record_cls.field_set:
+                columns.append((i, field, False))
+            else:
+                LOGGER.warning("unmapped CSV column: column=%s", field)
+        for row in rows:
+            yield {
+                field: row[i].replace(",", ".") if comma else row[i]
+                for i, field, comma in columns
+            }
+
+    def raw_records(self, resp, chunk_size, parameters):
+        """yield raw records of a streamed JSON or CSV export"""
+        if parameters.get("format") == "csv":
+            return self.csv_records(
+                resp, parameters.get("csvDelimiter", ","),
+                parameters.get("decimalCharacter")
+            )
+        return iter_json_array(resp, chunk_size)
+
+    def iter_records(self, chunk_size=CHUNK_SIZE, **kwargs):
+        """yield records as the export response arrives"""
+        with self.connector.connection() as conn, closing(
+            conn.records("stream", **kwargs)
+        ) as resp:
+            for raw_record in self.raw_records(resp, chunk_size, kwargs):
+                yield self.record_cls(raw_record)
+
+    def load_records(self, body, parameters):
+        """return records of a whole JSON or CSV export body"""
+        if parameters.get("format") == "csv":
+            raw_records = self.raw_records(
+                BytesIO(body), CHUNK_SIZE, parameters
+            )
+        else:
+            raw_records = json_loads(body)
+        return [self.record_cls(r) for r in raw_records]
+
+    def mirror_records(self, mirror, chunk_size=CHUNK_SIZE, **kwargs):
+        """stream export into a Mirror, return number of rows loaded"""
+        with self.connector.connection() as conn, closing(
+            conn.records("stream", **kwargs)
+        ) as resp:
+            return mirror.load(self.raw_records(resp, chunk_size, kwargs))
+
+    def record_arrays(self, chunk_size=CHUNK_SIZE, scaled=False, **kwargs):
+        """return dictionary of masked numpy arrays of streamed export"""
+        with self.connector.connection() as conn, closing(
+            conn.records("stream", **kwargs)
+        ) as resp:
+            return numpy_columns(
+                self.raw_records(resp, chunk_size, kwargs), self.metadata,
+                scaled
+            )
+
+    def record_frame(self, chunk_size=CHUNK_SIZE, **kwargs):
+        """return RecordFrame of streamed export"""
+        with self.connector.connection() as conn, closing(
+            conn.records("stream", **kwargs)
+        ) as resp:
+            return RecordFrame(
+                self.raw_records(resp, chunk_size, kwargs), self.metadata
+            )
+
+    def sync_records(self, store, chunk_size=CHUNK_SIZE):
+        """merge changes since last sync into `store`, return local copy"""
+        key = sync_key(*self.location)
+        store.sync(
+            self.connector, key, next(iter(self.metadata.field_map)),
+            chunk_size
+        )
+        return store.records(key)
 
     def factory(self, obj):
         """return a pacder object (i.e. REDCap abstraction)"""
@@ -78,3 +291,90 @@ class Project:
             return self.record_cls
         else:
             raise NotImplemented
+
+
+def async_unsupported(name):
+    """return method refusing a blocking Project method on AsyncProject"""
+    def unsupported(self, *args, **kwargs):
+        raise Exception(
+            "{} is not supported by AsyncProject".format(name)
+        )
+    unsupported.__name__ = name
+    unsupported.__doc__ = "refuse blocking {}".format(name)
+    return unsupported
+
+
+class AsyncProject(Project):
+    """asyncio container for REDCap project
+
+    Only metadata and record exports are awaitable so far; the blocking
+    Project methods that need a ConnectorPool raise instead.
+    """
+
+    __enter__ = async_unsupported("__enter__")
+    __exit__ = async_unsupported("__exit__")
+    __setitem__ = async_unsupported("__setitem__")
+    import_records = async_unsupported("import_records")
+    iter_records = async_unsupported("iter_records")
+    mirror_records = async_unsupported("mirror_records")
+    record_arrays = async_unsupported("record_arrays")
+    record_frame = async_unsupported("record_frame")
+    sync_records = async_unsupported("sync_records")
+
+    async def __aenter__(self):
+        """enter context, loading metadata"""
+        await self.open()
+        return self
+
+    async def __aexit__(self, typ, val, trb):
+        """exit context"""
+        await self.close()
+
+    def __getitem__(self, key):
+        """fetch (export) project resource"""
+        if key == "metadata":
+            async def closed(proj=self, **kwargs):
+                if not kwargs:
+                    return proj.metadata
+        elif key == "record":
+            async def closed(proj=self, workers=None, **kwargs):
+                if workers:
+                    records = await proj.connector.export_partitioned(
+                        workers=workers,
+                        record_id=next(iter(proj.metadata.field_map)),
+                        **kwargs
+                    )
+                else:
+                    records = await proj.connector.records(
+                        "export", **kwargs
+                    )
+                return proj.load_records(records, kwargs)
+        return closed
+
+    def __init__(self, host, path, token, **kwargs):
+        """constructor, metadata is loaded by `open`"""
+        self.connector = AsyncConnector(host, path, token, **kwargs)
+        self.lazy = False
+        self._metadata = self._record_cls = None
+
+    async def close(self):
+        """clean up self"""
+        await self.connector.close()
+
+    def load_metadata(self):
+        """refuse blocking metadata fetch"""
+        raise Exception("metadata not loaded, await open() first")
+
+    async def open(self):
+        """fetch metadata and field names concurrently"""
+        raw_metadata, field_names = await gather(
+            self.connector.metadata("export"),
+            self.connector.field_names("export"),
+        )
+        self.metadata = Metadata(
+            json_loads(raw_metadata),
+            field_names=json_loads(field_names),
+            project=self
+        )
+        self.build_record_cls()
+        return self
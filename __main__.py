@@ -1,50 +1,237 @@
+from asyncio import new_event_loop
+from csv import DictWriter
+from datetime import date, datetime, timedelta
+from gzip import compress as gzip_compress, decompress as gzip_decompress
 from http import client, server, HTTPStatus
-from threading import Thread
+from io import StringIO
+from tempfile import TemporaryDirectory
+from json import dumps as json_dumps, loads as json_loads
+from os import path as os_path
+from threading import Barrier, Thread
+from time import monotonic
 from unittest import (
-    defaultTestLoader, mock, TestCase, TextTestRunner
+    defaultTestLoader, mock, skipUnless, TestCase, TextTestRunner
 )
 from urllib.parse import parse_qs, urlparse
 
-from . import BaseConnector
+from . import AsyncProject, connector, Project, RequestMetrics
+from .connector import (
+    AsyncConnector, Connector, ConnectorPool, ImportJob, RequestEvent,
+    RetryPolicy, TokenBucket
+)
+from .metadata import COLUMNS, load_metadatum, Metadata, MetadataCache
+from .mirror import Mirror
+from .record import diff_records, Record, RecordFrame
+from .sync import SyncStore
+from .util import date_parser, datetime_parser, iter_json_array
+from .util import numpy, numpy_cast, time_parser
+
+
+def raw_metadatum(field_name, form_name, validation="", field_type="text"):
+    """return raw metadatum of a field, blank but for the given columns"""
+    metadatum = dict.fromkeys(COLUMNS, "")
+    metadatum.update({
+        COLUMNS[0]: field_name, COLUMNS[1]: form_name,
+        COLUMNS[3]: field_type, COLUMNS[4]: field_name,
+        COLUMNS[7]: validation,
+    })
+    return metadatum
+
+
+def raw_field_names(raw_metadata):
+    """return raw export field names of fields without choices"""
+    return [
+        {
+            "original_field_name": md[COLUMNS[0]], "choice_value": "",
+            "export_field_name": md[COLUMNS[0]],
+        }
+        for md in raw_metadata
+    ]
 
 
+TEST_METADATA = [
+    raw_metadatum("record_id", "demo"),
+    raw_metadatum("age", "demo", "integer"),
+    raw_metadatum("wt", "demo", "number"),
+    raw_metadatum("note", "visit", field_type="notes"),
+]
+TEST_FIELD_NAMES = raw_field_names(TEST_METADATA)
+TEST_RECORDS = [
+    {"record_id": str(i), "age": str(20 + i), "wt": wt, "note": note}
+    for i, (wt, note) in enumerate((
+        ("1.5", "n1"), ("2", 'said "]}, [{" über'), ("70.25", "☃"),
+        ("", ""), ("0.5", "line\nbreak"), ("3.0", "n6"),
+    ), 1)
+]
+
+
+HANGUP = 0 # MockAPIHandler failure closing the connection unanswered
 RESPONSE_DATA = {
     "testpost": b"oh stop it you",
-    "records": b'[{"patient_id": "p001"}]',
-    "metadata":  b"""
-        field_name,form_name,section_header,field_type,field_label,select_choices_or_calculations,field_note,text_validation_type_or_show_slider_number,text_validation_min,text_validation_max,identifier,branching_logic,required_field,custom_alignment,question_number,matrix_group_name,matrix_ranking,field_annotation
-        patient_id,demographics,,text,"Patient ID",,"Scan the bottom QR code",,,,,,,,,,,@BARCODE-APP
-    """.strip()
+    "records": json_dumps(TEST_RECORDS).encode("utf-8"),
+    "metadata": json_dumps(TEST_METADATA).encode("utf-8"),
+    "exportFieldNames": json_dumps(TEST_FIELD_NAMES).encode("utf-8"),
 }
 
 
 class MockAPIHandler(server.BaseHTTPRequestHandler):
-    """Handler subclass for tests"""
+    """Handler subclass for tests, serving a mock REDCap API"""
+
+    protocol_version = "HTTP/1.1"
+    exports = RESPONSE_DATA # export content -> response body
+    failures = [] # statuses answered in order, None serves the request
+    # and HANGUP closes the connection without answering
+    compress = False # gzip bodies when the client accepts it
+    chunk_size = 0 # send chunked bodies of this many bytes
+    close_delimited = False # end bodies by closing the connection
+    requests = [] # (client port, form) of every API request
+
+    @classmethod
+    def reset(cls, exports=RESPONSE_DATA):
+        """Forget requests and serve `exports` normally"""
+        cls.exports = exports
+        cls.failures = []
+        cls.compress = False
+        cls.chunk_size = 0
+        cls.close_delimited = False
+        cls.requests = []
+
+    def api(self, form):
+        """Answer a REDCap API request"""
+        self.requests.append((self.client_address[1], form))
+        host = "{}:{}".format(*self.server.server_address)
+        if self.headers["host"] != host:
+            self.send_error(HTTPStatus.BAD_REQUEST, "wrong host header")
+            return
+        if self.failures:
+            status = self.failures.pop(0)
+            if status == HANGUP:
+                self.close_connection = True
+                return
+            if status is not None:
+                self.send_response(status)
+                self.send_header("retry-after", "0")
+                self.send_header("content-length", "0")
+                self.end_headers()
+                return
+        if form.get("action") == ["import"]:
+            data = json_loads(form["data"][0])
+            self.respond(json_dumps({"count": len(data)}).encode("utf-8"))
+        elif form.get("content") == ["records"]:
+            self.respond(self.records(form))
+        elif form.get("content", [""])[0] in self.exports:
+            self.respond(self.exports[form["content"][0]])
+        else:
+            self.send_error(HTTPStatus.NOT_FOUND)
 
     def do_POST(self):
         """Handle POST requests"""
         url = urlparse(self.path)
-        query = parse_qs(url.query)
+        body = self.rfile.read(int(self.headers.get("content-length", 0)))
+        if self.headers.get("content-encoding") == "gzip":
+            body = gzip_decompress(body)
 
         # resources for testing pacder.connector.BaseConnector
         if url.path == "/test-base-connector":
             self.send_response(HTTPStatus.FOUND)
-            self.writeheader("Location", "/redirected")
+            self.send_header("location", "/redirected")
+            self.send_header("content-length", "0")
             self.end_headers()
         elif url.path == "/redirected":
-            self.send_response(HTTPStatus.OK)
-            self.end_headers()
-            self.wfile.write(RESPONSE_DATA["testpost"])
-        
-        # WIP resources for testing pacder.connector.BaseConnector
+            self.respond(RESPONSE_DATA["testpost"])
+
+        # resources for testing pacder.connector.Connector and Project
         elif url.path == "/redcap/api/":
-            self.send_response(HTTPStatus.OK)
-            self.end_headers()
-            
+            self.api(parse_qs(body.decode("utf-8")))
+
         # any other resource for testing both connectors
         else:
             self.send_error(HTTPStatus.NOT_FOUND)
 
+    def log_message(self, format, *args):
+        """Silence per-request logging"""
+        pass
+
+    def records(self, form):
+        """Return records export body, limited to the requested ones"""
+        records = json_loads(self.exports["records"])
+        ids = [v[0] for k,v in form.items() if k.startswith("records[")]
+        fields = [v[0] for k,v in form.items() if k.startswith("fields[")]
+        if ids:
+            records = [r for r in records if r["record_id"] in ids]
+        if fields:
+            records = [{f: r[f] for f in fields} for r in records]
+        if form.get("format") != ["csv"]:
+            return json_dumps(records).encode("utf-8")
+        if form.get("decimalCharacter") == ["comma"]:
+            records = [
+                dict(r, wt=r["wt"].replace(".", ",")) if "wt" in r else r
+                for r in records
+            ]
+        delimiter = form.get("csvDelimiter", [","])[0]
+        fp = StringIO(newline="")
+        writer = DictWriter(
+            fp, fields or list(records[0] if records else TEST_RECORDS[0]),
+            delimiter={"tab": "\t"}.get(delimiter, delimiter)
+        )
+        writer.writeheader()
+        writer.writerows(records)
+        return fp.getvalue().encode("utf-8")
+
+    def respond(self, data):
+        """Send 200 response, encoded and delimited as configured"""
+        self.send_response(HTTPStatus.OK)
+        self.send_header("content-type", "application/json")
+        if self.compress and "gzip" in self.headers.get(
+            "accept-encoding", ""
+        ):
+            data = gzip_compress(data)
+            self.send_header("content-encoding", "gzip")
+        if self.close_delimited:
+            self.end_headers()
+            self.wfile.write(data)
+            self.close_connection = True
+            return
+        if not self.chunk_size:
+            self.send_header("content-length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        self.send_header("transfer-encoding", "chunked")
+        self.end_headers()
+        for i in range(0, len(data), self.chunk_size):
+            chunk = data[i:i + self.chunk_size]
+            self.wfile.write(
+                "{:x}\r\n".format(len(chunk)).encode("latin-1")
+                + chunk + b"\r\n"
+            )
+        self.wfile.write(b"0\r\n\r\n")
+
+
+class LocalConnector(Connector):
+    """Connector speaking plain HTTP to the mock API"""
+
+    connect = client.HTTPConnection.connect
+
+
+class EventLog:
+    """Instrument recording each RequestEvent as it is reported"""
+
+    def __init__(self):
+        """Construct empty log"""
+        self.events = []
+
+    def request_finished(self, event):
+        """Record finished event"""
+        self.events.append((
+            "finished", event.content, event.action, event.status,
+            event.response_octets, event.error is not None
+        ))
+
+    def request_started(self, event):
+        """Record started event"""
+        self.events.append(("started", event.content, event.action))
+
 
 class WebTestCase(TestCase):
     """Base class for web-related tests"""
@@ -53,35 +240,957 @@ class WebTestCase(TestCase):
     def setUpClass(cls):
         """Set up HTTP server"""
         cls.service = server.ThreadingHTTPServer(
-            ("127.0.0.1", 8080), MockAPIHandler
+            ("127.0.0.1", 0), MockAPIHandler
         )
-        t = Thread(target=cls.service.serve_forever)
+        cls.host = "127.0.0.1:{}".format(cls.service.server_address[1])
+        t = Thread(target=cls.service.serve_forever, daemon=True)
         t.start()
 
     @classmethod
     def tearDownClass(cls):
         """Tear down HTTP server"""
         cls.service.shutdown()
+        cls.service.server_close()
+
+    def setUp(self):
+        """Reset mock API and patch pools to plain HTTP"""
+        MockAPIHandler.reset()
+        patcher = mock.patch.object(connector, "Connector", LocalConnector)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def connector(self, path="/redcap/api/", **kwargs):
+        """Return plain HTTP connector to the mock API"""
+        return LocalConnector(self.host, path, "0" * 32, **kwargs)
 
 
 class TestBaseConnector(WebTestCase):
     """Test BaseConnector object"""
-    pass
+
+    def test_redirect(self):
+        """Redirects are followed"""
+        with self.connector("/test-base-connector") as conn:
+            resp = conn.post(b"")
+            self.assertEqual(resp.status, HTTPStatus.OK)
+            self.assertEqual(resp.read(), RESPONSE_DATA["testpost"])
+
+    def test_retry_after(self):
+        """Retryable statuses are retried after Retry-After seconds"""
+        MockAPIHandler.failures = [
+            HTTPStatus.SERVICE_UNAVAILABLE, HTTPStatus.TOO_MANY_REQUESTS,
+        ]
+        policy = RetryPolicy(backoff=5.0, jitter=0)
+        started = monotonic()
+        with self.connector(retry_policy=policy) as conn:
+            body = conn.metadata("export")
+        self.assertLess(monotonic() - started, 2.5)
+        self.assertEqual(body, RESPONSE_DATA["metadata"])
+        self.assertEqual(len(MockAPIHandler.requests), 3)
+
+    def test_retry_exhausted(self):
+        """The last response is returned once retries run out"""
+        MockAPIHandler.failures = [HTTPStatus.BAD_GATEWAY] * 3
+        with self.connector(retry_policy=RetryPolicy(retries=2)) as conn:
+            resp = conn.post(conn.url_encode(
+                action="export", content="metadata"
+            ))
+            self.assertEqual(resp.status, HTTPStatus.BAD_GATEWAY)
+            resp.read()
+        self.assertEqual(len(MockAPIHandler.requests), 3)
+
+    def test_rate_limiter(self):
+        """A shared bucket spaces the requests of every connector"""
+        bucket = TokenBucket(20, burst=1)
+        started = monotonic()
+        with self.connector(rate_limiter=bucket) as conn:
+            with conn.copy() as other:
+                for _ in range(3):
+                    conn.metadata("export")
+                    other.metadata("export")
+        self.assertGreaterEqual(monotonic() - started, 0.2)
+
+    def test_gzip(self):
+        """Compressed responses are decoded, whole or in pieces"""
+        MockAPIHandler.compress = True
+        expected = RESPONSE_DATA["records"]
+        with self.connector() as conn:
+            resp = conn.records("stream")
+            self.assertEqual(resp.headers["content-encoding"], "gzip")
+            pieces = iter(lambda: resp.read(7), b"")
+            self.assertEqual(b"".join(pieces), expected)
+            self.assertEqual(conn.records("export"), expected)
+
+    def test_instrument(self):
+        """Events finish once read, counting the octets received"""
+        MockAPIHandler.compress = True
+        log = EventLog()
+        with self.connector(instrument=log) as conn:
+            resp = conn.records("stream")
+            octets = int(resp.headers["content-length"])
+            self.assertEqual(log.events, [("started", "records", "export")])
+            body = b"".join(iter(lambda: resp.read(7), b""))
+            self.assertEqual(body, RESPONSE_DATA["records"])
+            self.assertLess(octets, len(body))
+            imported = conn.records("import", data=json_dumps(TEST_RECORDS))
+        self.assertEqual(log.events, [
+            ("started", "records", "export"),
+            ("finished", "records", "export", 200, octets, False),
+            ("started", "records", "import"),
+            (
+                "finished", "records", "import", 200,
+                len(gzip_compress(imported)), False
+            ),
+        ])
+        MockAPIHandler.failures = [HANGUP]
+        with self.connector(
+            instrument=log, retry_policy=RetryPolicy(retries=0)
+        ) as conn:
+            self.assertRaises(Exception, conn.metadata, "export")
+        self.assertEqual(
+            log.events[-1], ("finished", "metadata", "export", None, 0, True)
+        )
+
+    def test_compress_requests(self):
+        """Import bodies are sent compressed"""
+        with self.connector(compress_requests=True) as conn:
+            body = conn.records(
+                "import", data=json_dumps(TEST_RECORDS), format="json"
+            )
+        self.assertEqual(json_loads(body), {"count": 6})
+        self.assertEqual(
+            json_loads(MockAPIHandler.requests[0][1]["data"][0]),
+            TEST_RECORDS
+        )
 
 
 class TestConnector(WebTestCase):
     """Test Connector object"""
-    pass
+
+    def test_iter_json_array_chunks(self):
+        """Items split across any chunk boundary are decoded"""
+        for size in (1, 2, 3, 7, 64):
+            MockAPIHandler.chunk_size = size
+            for chunk_size in (1, 2, 5, 4096):
+                with self.connector() as conn:
+                    resp = conn.records("stream")
+                    self.assertEqual(
+                        list(iter_json_array(resp, chunk_size)),
+                        TEST_RECORDS, (size, chunk_size)
+                    )
+
+    def test_import_retry(self):
+        """Imports retry on 503 but not on 502"""
+        data = json_dumps(TEST_RECORDS[:2])
+        policy = RetryPolicy(backoff=0)
+        MockAPIHandler.failures = [HTTPStatus.SERVICE_UNAVAILABLE]
+        with self.connector(retry_policy=policy) as conn:
+            body = conn.import_content("record", data, format="json")
+            self.assertEqual(json_loads(body), {"count": 2})
+            self.assertEqual(len(MockAPIHandler.requests), 2)
+            MockAPIHandler.failures = [HTTPStatus.BAD_GATEWAY]
+            self.assertEqual(
+                conn.import_content("record", data, format="json"), b""
+            )
+            self.assertEqual(len(MockAPIHandler.requests), 3)
+
+    def test_pool_reuse(self):
+        """Pooled connections are kept alive between requests"""
+        pool = ConnectorPool(self.host, "/redcap/api/", "0" * 32, size=2)
+        with pool:
+            for _ in range(5):
+                self.assertEqual(
+                    pool.metadata("export"), RESPONSE_DATA["metadata"]
+                )
+            pool.map_concurrent(
+                lambda conn, _: conn.field_names("export"), range(6), 2
+            )
+        pool.close()
+        ports = {port for port, _ in MockAPIHandler.requests}
+        self.assertEqual(len(MockAPIHandler.requests), 11)
+        self.assertLessEqual(len(ports), 2)
+
+    def test_pool_grows(self):
+        """Asking for more workers than connections grows the pool"""
+        pool = ConnectorPool(self.host, "/redcap/api/", "0" * 32, size=2)
+        barrier = Barrier(4, timeout=5)
+        def call(conn, _):
+            barrier.wait() # breaks unless all four run at once
+            return conn.field_names("export")
+        with pool:
+            self.assertEqual(
+                pool.map_concurrent(call, range(8), 4),
+                [RESPONSE_DATA["exportFieldNames"]] * 8
+            )
+        pool.close()
+        self.assertEqual(pool.size, 4)
+        ports = {port for port, _ in MockAPIHandler.requests}
+        self.assertLessEqual(len(ports), 4)
+
+
+class TestAsyncConnector(WebTestCase):
+    """Test AsyncConnector and AsyncProject objects"""
+
+    def run_async(self, coro):
+        """Return result of `coro`, run on a new event loop"""
+        loop = new_event_loop()
+        try:
+            return loop.run_until_complete(coro)
+        finally:
+            loop.close()
+
+    def connector(self, path="/redcap/api/", **kwargs):
+        """Return asyncio connector to the mock API"""
+        return AsyncConnector(
+            self.host, path, "0" * 32, ssl=False, **kwargs
+        )
+
+    def test_status_and_headers(self):
+        """Status line and headers are parsed, errors returned as is"""
+        async def post():
+            async with self.connector() as conn:
+                ok = await conn.post(conn.url_encode(
+                    action="export", content="metadata"
+                ))
+                missing = await conn.post(conn.url_encode(
+                    action="export", content="arm"
+                ))
+                return ok, missing, len(conn.idle)
+        ok, missing, idle = self.run_async(post())
+        self.assertEqual((ok.status, ok.reason), (200, "OK"))
+        self.assertEqual(ok.headers["content-type"], "application/json")
+        self.assertEqual(ok.read(), RESPONSE_DATA["metadata"])
+        self.assertEqual((missing.status, missing.reason), (404, "Not Found"))
+        self.assertEqual(missing.headers["connection"], "close")
+        self.assertEqual(idle, 0)
+
+    def test_bodies(self):
+        """Length-delimited, chunked and close-delimited bodies are read"""
+        async def export():
+            async with self.connector() as conn:
+                return [
+                    await conn.records("export"),
+                    await conn.records("export"),
+                ], len(conn.idle)
+        for chunk_size, close_delimited in ((0, 0), (1, 0), (7, 0), (0, 1)):
+            MockAPIHandler.chunk_size = chunk_size
+            MockAPIHandler.close_delimited = close_delimited
+            bodies, idle = self.run_async(export())
+            self.assertEqual(bodies, [RESPONSE_DATA["records"]] * 2)
+            self.assertEqual(idle, 0 if close_delimited else 1)
+        ports = [port for port, _ in MockAPIHandler.requests]
+        self.assertEqual(len(set(ports[:6])), 3) # one socket per export
+        self.assertEqual(len(set(ports[6:])), 2)
+
+    def test_gzip(self):
+        """Compressed responses are decoded"""
+        MockAPIHandler.compress = True
+        async def export():
+            async with self.connector(compress_requests=True) as conn:
+                return (
+                    await conn.records("export"),
+                    await conn.records(
+                        "import", data=json_dumps(TEST_RECORDS)
+                    ),
+                )
+        records, imported = self.run_async(export())
+        self.assertEqual(records, RESPONSE_DATA["records"])
+        self.assertEqual(json_loads(imported), {"count": 6})
+
+    def test_instrument(self):
+        """Events count the octets received, not the decoded body"""
+        MockAPIHandler.compress = True
+        log = EventLog()
+        async def export():
+            async with self.connector(instrument=log) as conn:
+                return await conn.records("export")
+        self.assertEqual(self.run_async(export()), RESPONSE_DATA["records"])
+        self.assertEqual(log.events, [
+            ("started", "records", "export"),
+            (
+                "finished", "records", "export", 200,
+                len(gzip_compress(RESPONSE_DATA["records"])), False
+            ),
+        ])
+
+    def test_stale_keep_alive(self):
+        """Only idempotent requests are resent when a reused socket fails"""
+        MockAPIHandler.failures = [None, HANGUP, None, None, HANGUP]
+        async def requests():
+            async with self.connector() as conn:
+                bodies = [
+                    await conn.metadata("export"),
+                    await conn.metadata("export"),
+                ]
+                await conn.field_names("export")
+                with self.assertRaises(client.RemoteDisconnected):
+                    await conn.records(
+                        "import", data=json_dumps(TEST_RECORDS)
+                    )
+                return bodies
+        self.assertEqual(
+            self.run_async(requests()), [RESPONSE_DATA["metadata"]] * 2
+        )
+        ports = [port for port, _ in MockAPIHandler.requests]
+        self.assertEqual(len(ports), 5)
+        self.assertEqual(ports[0], ports[1])
+        self.assertNotEqual(ports[1], ports[2])
+
+    def test_redirect(self):
+        """Redirects are followed"""
+        async def post():
+            async with self.connector("/test-base-connector") as conn:
+                return await conn.post(b"")
+        resp = self.run_async(post())
+        self.assertEqual(resp.status, HTTPStatus.OK)
+        self.assertEqual(resp.read(), RESPONSE_DATA["testpost"])
+
+    def test_retry_after(self):
+        """Retryable statuses are retried after Retry-After seconds"""
+        MockAPIHandler.failures = [
+            HTTPStatus.SERVICE_UNAVAILABLE, HTTPStatus.TOO_MANY_REQUESTS,
+        ]
+        async def export():
+            policy = RetryPolicy(backoff=5.0, jitter=0)
+            async with self.connector(retry_policy=policy) as conn:
+                return await conn.metadata("export")
+        started = monotonic()
+        self.assertEqual(self.run_async(export()), RESPONSE_DATA["metadata"])
+        self.assertLess(monotonic() - started, 2.5)
+        self.assertEqual(len(MockAPIHandler.requests), 3)
+
+    def test_project(self):
+        """AsyncProject exports records, whole or partitioned"""
+        async def export():
+            async with AsyncProject(
+                self.host, "/redcap/api/", "0" * 32, ssl=False
+            ) as project:
+                with self.assertRaises(Exception):
+                    project.iter_records()
+                return (
+                    await project["record"](),
+                    await project["record"](workers=2, batch_size=4),
+                    await project["record"](format="csv"),
+                )
+        for records in self.run_async(export()):
+            self.assertEqual([r.raw() for r in records], TEST_RECORDS)
+        MockAPIHandler.failures = [None, None, None, HTTPStatus.BAD_REQUEST]
+        async def failed_export():
+            async with AsyncProject(
+                self.host, "/redcap/api/", "0" * 32, ssl=False
+            ) as project:
+                await project["record"](workers=1, batch_size=4)
+        with self.assertRaises(Exception):
+            self.run_async(failed_export())
 
 
 class TestMetadata(TestCase):
     """Test Metadata object"""
-    pass
+
+    def setUp(self):
+        """Load the test metadata"""
+        self.metadata = Metadata(TEST_METADATA, field_names=TEST_FIELD_NAMES)
+
+    def serialized(self):
+        """Return the CSV, JSON and SQL serializations"""
+        return self.metadata.csv(), self.metadata.json(), self.metadata.sql()
+
+    def test_raw(self):
+        """Raw metadata is cached, but each call returns fresh copies"""
+        raw = self.metadata.raw()
+        self.assertEqual(raw, self.metadata.raw())
+        self.assertEqual(
+            sorted(md[COLUMNS[0]] for md in raw),
+            sorted(md[COLUMNS[0]] for md in TEST_METADATA)
+        )
+        raw[0][COLUMNS[4]] = "changed"
+        del raw[1]
+        self.assertEqual(self.metadata.raw(), self.metadata.raw())
+        self.assertNotIn(
+            "changed", [md[COLUMNS[4]] for md in self.metadata.raw()]
+        )
+        self.assertEqual(len(self.metadata.raw()), len(TEST_METADATA))
+
+    def test_invalidate(self):
+        """Changing the metadata drops the cached serializations"""
+        before = self.serialized()
+        self.assertIs(self.metadata.csv(), before[0])
+        self.metadata["bmi"] = load_metadatum(
+            raw_metadatum("bmi", "demo", "number")
+        )
+        added = self.serialized()
+        for text in added:
+            self.assertIn("bmi", text)
+        del self.metadata["bmi"]
+        self.assertEqual(self.serialized(), before)
+        metadatum = dict.__getitem__(self.metadata, "note")
+        metadatum[COLUMNS[4]] = "Renamed note"
+        self.assertEqual(self.serialized(), before)
+        self.metadata.invalidate()
+        for text in self.serialized()[:2]:
+            self.assertIn("Renamed note", text)
+
+
+class TestBranchingLogic(TestCase):
+    """Test compiled branching logic and calculations"""
+
+    LOGIC = { # field -> branching logic
+        "eq": "[x] = 3", "ne": "[y] <> ''", "both": "[x] > 2 and [y] = 'a'",
+        "either": "[x] > 5 OR [y] = 'a'", "checked": "[cb(1)] = '1'",
+        "cond": "if([x] > 2, 1, 0) = 1", "big": "[x]^2 > 3",
+        "attr": "().__class__", "dunder": "[x].__class__ = ''",
+        "builtin": "__import__('os') = 1", "call": "open('x') = 1",
+    }
+    CALCULATIONS = {
+        "total": "sum([x], [z])", "sq": "[x]^2", "cube": "2 ^ [x]",
+        "rem": "[x] % 2", "neg": "-[x] + 1",
+    }
+
+    def setUp(self):
+        """Build metadata with logic and calculations on x, y, z, cb"""
+        raw_metadata = TEST_METADATA[:1] + [
+            raw_metadatum("x", "demo", "number"),
+            raw_metadatum("y", "demo"),
+            raw_metadatum("z", "demo", "number"),
+            dict(
+                raw_metadatum("cb", "demo", field_type="checkbox"),
+                **{COLUMNS[5]: "1, A | 2, B"}
+            ),
+        ]
+        for field, logic in self.LOGIC.items():
+            raw_metadata.append(
+                dict(raw_metadatum(field, "visit"), **{COLUMNS[11]: logic})
+            )
+        for field, calculation in self.CALCULATIONS.items():
+            raw_metadata.append(dict(
+                raw_metadatum(field, "visit", field_type="calc"),
+                **{COLUMNS[5]: calculation}
+            ))
+        field_names = raw_field_names(
+            md for md in raw_metadata if md[COLUMNS[0]] != "cb"
+        ) + [
+            {
+                "original_field_name": "cb", "choice_value": choice,
+                "export_field_name": "cb___" + choice,
+            }
+            for choice in "12"
+        ]
+        self.logic = Metadata(raw_metadata, field_names=field_names).logic
+
+    def test_sandbox(self):
+        """Attributes, dunder names and other calls are never compiled"""
+        self.assertEqual(
+            set(self.LOGIC) - set(self.logic.codes),
+            {"attr", "dunder", "builtin", "call"}
+        )
+
+    def test_evaluate(self):
+        """Operators, checkboxes and if() follow REDCap semantics"""
+        shown = self.logic.evaluate_batch([
+            {"x": "3", "y": "a", "cb___1": "1", "cb___2": "0"},
+            {"x": "1", "y": "", "cb___1": "0", "cb___2": "1"},
+        ])
+        self.assertEqual(shown, [
+            {
+                "eq": True, "ne": True, "both": True, "either": True,
+                "checked": True, "cond": True, "big": True,
+            },
+            {
+                "eq": False, "ne": False, "both": False, "either": False,
+                "checked": False, "cond": False, "big": False,
+            },
+        ])
+
+    def test_calculations(self):
+        """Calculations are written back, blank operands skipped by sum()"""
+        record = {"x": "3", "z": ""}
+        self.logic.reevaluate(record, ["x", "z"])
+        self.assertEqual(
+            {f: record[f] for f in self.CALCULATIONS},
+            {"total": "3", "sq": "9", "cube": "8", "rem": "1", "neg": "-2"}
+        )
+        record = {"x": "", "z": "2.5"}
+        self.logic.reevaluate(record, ["x", "z"])
+        self.assertEqual(
+            {f: record[f] for f in self.CALCULATIONS},
+            {"total": "2.5", "sq": "", "cube": "", "rem": "", "neg": ""}
+        )
+
+
+class TestMirror(TestCase):
+    """Test Mirror object"""
+
+    def test_keywords_and_migration(self):
+        """SQL keywords are valid names, new fields add columns"""
+        raw_metadata = [
+            raw_metadatum("record_id", "group"),
+            raw_metadatum("order", "group", "integer"),
+        ]
+        records = [
+            {"record_id": str(i), "order": str(i * 2)} for i in range(1, 4)
+        ]
+        with TemporaryDirectory() as directory:
+            path = os_path.join(directory, "mirror.db")
+            metadata = Metadata(
+                raw_metadata, field_names=raw_field_names(raw_metadata)
+            )
+            with Mirror(path, metadata, batch_size=2) as mirror:
+                self.assertEqual(mirror.load(records), 3)
+            raw_metadata.append(raw_metadatum("select", "group"))
+            metadata = Metadata(
+                raw_metadata, field_names=raw_field_names(raw_metadata)
+            )
+            with Mirror(path, metadata) as mirror:
+                mirror.load([dict(records[0], select="x")])
+                self.assertEqual(
+                    mirror.execute(
+                        'SELECT "record_id", "order", "select"'
+                        ' FROM "group" ORDER BY "record_id"'
+                    ).fetchall(),
+                    [("1", 2, "x"), ("2", 4, None), ("3", 6, None)]
+                )
+
+
+class TestRecord(TestCase):
+    """Test Record and RecordFrame objects"""
+
+    def setUp(self):
+        """Build record class and frame of TEST_RECORDS"""
+        self.metadata = Metadata(
+            TEST_METADATA, field_names=TEST_FIELD_NAMES
+        )
+        project = mock.Mock(metadata=self.metadata)
+        self.record_cls = Record.for_project(project)
+        self.frame = RecordFrame(TEST_RECORDS, self.metadata)
+
+    def test_reserved_field_names(self):
+        """Fields named like Record attributes are rejected"""
+        for name in ("raw", "dirty", "fields", "project", "Record__dirty"):
+            raw_metadata = TEST_METADATA + [raw_metadatum(name, "demo")]
+            metadata = Metadata(
+                raw_metadata, field_names=raw_field_names(raw_metadata)
+            )
+            for lazy in (False, True):
+                with self.assertRaises(Exception, msg=name):
+                    Record.for_project(mock.Mock(metadata=metadata), lazy)
+
+    def test_diff_record_frame(self):
+        """Records and frame rows of one export are equal"""
+        records = [self.record_cls(r) for r in TEST_RECORDS]
+        diff = diff_records(records, self.frame, "record_id")
+        self.assertEqual(diff, ([], [], {}))
+        diff = diff_records(
+            self.frame, TEST_RECORDS, "record_id", self.metadata
+        )
+        self.assertEqual(diff, ([], [], {}))
+
+    def test_diff_frame_scale(self):
+        """A value with more decimals changes no other row"""
+        raw_records = TEST_RECORDS + [dict(TEST_RECORDS[0], record_id="7")]
+        raw_records[-1]["wt"] = "1.125"
+        frame = RecordFrame(raw_records, self.metadata)
+        diff = diff_records(self.frame, frame, "record_id")
+        self.assertEqual(diff.added, [("7", "", "", "")])
+        self.assertEqual((diff.removed, diff.changed), ([], {}))
+
+    def test_diff_changed(self):
+        """Changed values are reported per row and field"""
+        records = [self.record_cls(r) for r in TEST_RECORDS]
+        records[0].wt = "1.75"
+        diff = diff_records(self.frame, records, "record_id")
+        self.assertEqual(
+            diff.changed, {("1", "", "", ""): {"wt": ("1.5", "1.75")}}
+        )
+
+
+class TestParsers(TestCase):
+    """Test memoized date, datetime and time parsers"""
+
+    def test_fast_path_agrees(self):
+        """Fast paths reject what strptime rejects"""
+        cases = (
+            (date_parser("ymd"), "2020-+1-05"),
+            (date_parser("dmy"), "05- 1-2020"),
+            (datetime_parser("ymd", seconds=True), "2020-01-05 10:20x30"),
+            (datetime_parser("mdy"), "01-05-2020 1 :20"),
+            (time_parser("%H:%M"), "+1:05"),
+        )
+        for parse, value in cases:
+            with self.assertRaises(ValueError, msg=value):
+                parse(value)
+
+    def test_parse(self):
+        """Valid values parse on the fast path"""
+        self.assertEqual(
+            str(datetime_parser("dmy", seconds=True)("05-01-2020 10:20:30")),
+            "2020-01-05 10:20:30"
+        )
+        self.assertEqual(str(date_parser("mdy")("01-05-2020")), "2020-01-05")
+        self.assertEqual(str(time_parser("%M:%S")("11:05")), "00:11:05")
+
+
+@skipUnless(numpy, "numpy is not installed")
+class TestNumpyCast(TestCase):
+    """Test vectorized casting of raw columns"""
+
+    def test_numbers(self):
+        """Comma decimals are read and scaled numbers are integers"""
+        self.assertEqual(
+            numpy_cast(["1,5", "", "2,25"], "number_comma_decimal").tolist(),
+            [1.5, None, 2.25]
+        )
+        self.assertEqual(
+            numpy_cast(["1.5", "2.25", ""], "number", scaled=True).tolist(),
+            [150, 225, None]
+        )
+        self.assertEqual(
+            numpy_cast(
+                ["1,5", "3,0"], "number_1dp_comma_decimal", scaled=True
+            ).tolist(),
+            [15, 30]
+        )
+
+    def test_dates(self):
+        """Dates and datetimes are reordered from dmy and mdy"""
+        self.assertEqual(
+            numpy_cast(["05-01-2020", "", "31-12-1999"], "date_dmy").tolist(),
+            [date(2020, 1, 5), None, date(1999, 12, 31)]
+        )
+        self.assertEqual(
+            numpy_cast(["01-05-2020"], "date_mdy").tolist(),
+            [date(2020, 1, 5)]
+        )
+        self.assertEqual(
+            numpy_cast(["05-01-2020 10:20"], "datetime_dmy").tolist(),
+            [datetime(2020, 1, 5, 10, 20)]
+        )
+        self.assertEqual(
+            numpy_cast(
+                ["01-05-2020 10:20:30"], "datetime_seconds_mdy"
+            ).tolist(),
+            [datetime(2020, 1, 5, 10, 20, 30)]
+        )
+
+    def test_times(self):
+        """Times are hours and minutes, or minutes and seconds"""
+        self.assertEqual(
+            numpy_cast(["10:20", ""], "time").tolist(),
+            [timedelta(hours=10, minutes=20), None]
+        )
+        self.assertEqual(
+            numpy_cast(["11:05"], "time_mm_ss").tolist(),
+            [timedelta(minutes=11, seconds=5)]
+        )
+
+    def test_blank_columns(self):
+        """All-blank columns are fully masked"""
+        for data_type in (
+            "", "integer", "number", "number_2dp", "date_ymd",
+            "datetime_seconds_dmy", "time",
+        ):
+            for scaled in (False, True):
+                values = numpy_cast(["", ""], data_type, scaled)
+                self.assertEqual(values.tolist(), [None, None], data_type)
+
+
+class TestRequestMetrics(TestCase):
+    """Test RequestMetrics object"""
+
+    def test_prometheus(self):
+        """Finished events render as labelled histograms and counters"""
+        metrics = RequestMetrics()
+        event = RequestEvent("records", "export", 10)
+        metrics.request_started(event)
+        self.assertIn("pacder_requests_in_flight 1\n", metrics.prometheus())
+        event.status, event.ttfb, event.response_octets = 200, 0.001, 300
+        event.finish(metrics)
+        event.finish(metrics) # reported once
+        failed = RequestEvent('say "hi"\n', None, 0)
+        metrics.request_started(failed)
+        failed.finish(metrics, OSError("reset"))
+        lines = metrics.prometheus().splitlines()
+        labels = 'content="records",action="export"'
+        for line in (
+            "pacder_requests_in_flight 0",
+            "# TYPE pacder_request_duration_seconds histogram",
+            "pacder_request_duration_seconds_count"
+            '{' + labels + ',status="200"} 1',
+            "pacder_request_ttfb_seconds_bucket"
+            '{' + labels + ',status="200",le="0.005"} 1',
+            "pacder_response_size_bytes_bucket"
+            '{' + labels + ',status="200",le="256"} 0',
+            "pacder_response_size_bytes_bucket"
+            '{' + labels + ',status="200",le="1024"} 1',
+            "pacder_response_size_bytes_bucket"
+            '{' + labels + ',status="200",le="+Inf"} 1',
+            "pacder_response_size_bytes_sum"
+            '{' + labels + ',status="200"} 300.0',
+            "pacder_request_bytes_total{" + labels + "} 10",
+            "# TYPE pacder_request_errors_total counter",
+            'pacder_request_errors_total{content="say \\"hi\\"\\n",'
+            'action=""} 1',
+            'pacder_request_duration_seconds_count{content="say \\"hi\\"'
+            '\\n",action="",status="error"} 1',
+        ):
+            self.assertIn(line, lines)
+        self.assertFalse(
+            [l for l in lines if "errors_total" in l and "records" in l]
+        )
 
 
 class TestProject(WebTestCase):
     """Test Project object"""
-    pass
+
+    def setUp(self):
+        """Connect project to the mock API"""
+        super().setUp()
+        self.project = Project(self.host, "/redcap/api/", "0" * 32)
+        self.addCleanup(self.project.close)
+
+    def imported(self):
+        """Return record ids of every import request, in order"""
+        return [
+            [r["record_id"] for r in json_loads(form["data"][0])]
+            for _, form in MockAPIHandler.requests
+            if form.get("action") == ["import"]
+        ]
+
+    def test_iter_records(self):
+        """Streamed records arrive in order with the exported values"""
+        MockAPIHandler.chunk_size = 5
+        records = self.project["record"](stream=True)
+        self.assertEqual(
+            [r.raw() for r in records], TEST_RECORDS
+        )
+
+    def test_csv_records(self):
+        """CSV exports stream in any delimiter and decimal character"""
+        MockAPIHandler.chunk_size = 3
+        for delimiter in (",", "tab", ";", "|"):
+            for decimal in ("", "comma"):
+                records = self.project["record"](
+                    stream=True, format="csv", csvDelimiter=delimiter,
+                    decimalCharacter=decimal
+                )
+                self.assertEqual(
+                    [r.raw() for r in records], TEST_RECORDS,
+                    (delimiter, decimal)
+                )
+        self.assertIn("line\nbreak", [r["note"] for r in TEST_RECORDS])
+
+    def test_csv_records_columns(self):
+        """Columns outside the metadata are kept if known, else dropped"""
+        MockAPIHandler.exports = dict(RESPONSE_DATA, records=json_dumps([
+            dict(r, redcap_event_name="v1_arm_1", mystery="?")
+            for r in TEST_RECORDS
+        ]).encode("utf-8"))
+        with self.assertLogs("package", "WARNING") as logs:
+            records = list(self.project.iter_records(format="csv"))
+        self.assertEqual(
+            [r.raw() for r in records],
+            [dict(r, redcap_event_name="v1_arm_1") for r in TEST_RECORDS]
+        )
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("column=mystery", logs.output[0])
+
+    def test_export_partitioned(self):
+        """Batches merge into the whole export, as JSON or CSV"""
+        for fmt in ("json", "csv"):
+            records = self.project["record"](
+                workers=2, batch_size=4, format=fmt
+            )
+            self.assertEqual([r.raw() for r in records], TEST_RECORDS)
+        batches = [
+            sorted(v[0] for k,v in form.items() if k.startswith("records["))
+            for _, form in MockAPIHandler.requests
+        ]
+        self.assertEqual(
+            sorted(b for b in batches if b),
+            [["1", "2", "3", "4"]] * 2 + [["5", "6"]] * 2
+        )
+
+    def test_export_partitioned_failure(self):
+        """A failed batch raises rather than dropping its records"""
+        MockAPIHandler.failures = [None, HTTPStatus.BAD_REQUEST]
+        with self.assertRaises(Exception):
+            self.project["record"](workers=1, batch_size=2)
+        MockAPIHandler.failures = [HTTPStatus.BAD_REQUEST]
+        with self.assertRaises(Exception):
+            self.project["record"](workers=1, batch_size=2)
+
+    def test_connector_options(self):
+        """Connector options reach every pooled connection"""
+        project = Project(
+            self.host, "/redcap/api/", "0" * 32,
+            retry_policy=RetryPolicy(backoff=0)
+        )
+        self.addCleanup(project.close)
+        MockAPIHandler.failures = [HTTPStatus.SERVICE_UNAVAILABLE] * 2
+        self.assertEqual(
+            [r.raw() for r in project["record"](workers=2, batch_size=3)],
+            TEST_RECORDS
+        )
+
+    def cached_project(self, directory, max_age):
+        """Return project loading its metadata through a MetadataCache"""
+        project = Project(
+            self.host, "/redcap/api/", "0" * 32,
+            cache=MetadataCache(directory, max_age)
+        )
+        self.addCleanup(project.close)
+        return project
+
+    def test_metadata_cache(self):
+        """A fresh snapshot is used without any request"""
+        with TemporaryDirectory() as directory:
+            self.cached_project(directory, 3600)
+            del MockAPIHandler.requests[:]
+            project = self.cached_project(directory, 3600)
+            self.assertEqual(MockAPIHandler.requests, [])
+        self.assertEqual(list(project.metadata.field_map), [
+            md[COLUMNS[0]] for md in TEST_METADATA
+        ])
+
+    def test_metadata_cache_revalidate(self):
+        """A stale snapshot is kept while the metadata is unchanged"""
+        with TemporaryDirectory() as directory:
+            self.cached_project(directory, 0)
+            del MockAPIHandler.requests[:]
+            self.cached_project(directory, 0)
+            self.assertEqual(
+                [form["content"] for _, form in MockAPIHandler.requests],
+                [["metadata"]]
+            )
+            raw_metadata = TEST_METADATA + [
+                raw_metadatum("bmi", "demo", "number")
+            ]
+            MockAPIHandler.exports = dict(
+                RESPONSE_DATA,
+                metadata=json_dumps(raw_metadata).encode("utf-8"),
+                exportFieldNames=json_dumps(
+                    raw_field_names(raw_metadata)
+                ).encode("utf-8")
+            )
+            project = self.cached_project(directory, 0)
+            self.assertIn("bmi", project.metadata.field_map)
+            self.assertIn("bmi", self.cached_project(directory, 3600).metadata)
+
+    def test_sync_round_trip(self):
+        """A sync copies every record, a resync drops deleted ones"""
+        with SyncStore() as store:
+            self.assertEqual(
+                self.project.sync_records(store), TEST_RECORDS
+            )
+            form = MockAPIHandler.requests[-2][1]
+            self.assertIn("dateRangeEnd", form)
+            self.assertNotIn("dateRangeBegin", form)
+            MockAPIHandler.exports = dict(
+                RESPONSE_DATA,
+                records=json_dumps(TEST_RECORDS[1:]).encode("utf-8")
+            )
+            records = self.project["record"](sync=store)
+            self.assertEqual([r.raw() for r in records], TEST_RECORDS[1:])
+            self.assertIn("dateRangeBegin", MockAPIHandler.requests[-2][1])
+            with self.assertRaises(Exception):
+                self.project["record"](sync=store, fields=["age"])
+
+    def test_mirror_round_trip(self):
+        """Mirrored rows read back as the exported values"""
+        MockAPIHandler.chunk_size = 5
+        with Mirror(":memory:", self.project.metadata) as mirror:
+            self.assertEqual(self.project.mirror_records(mirror), 6)
+            self.assertEqual(
+                mirror.execute(
+                    'SELECT "record_id", "age", "wt" FROM "demo"'
+                    ' ORDER BY "age"'
+                ).fetchall(),
+                [
+                    (r["record_id"], int(r["age"]),
+                     float(r["wt"]) if r["wt"] else None)
+                    for r in TEST_RECORDS
+                ]
+            )
+            self.assertEqual(
+                [r[0] for r in mirror.execute('SELECT "note" FROM "visit"')],
+                [r["note"] for r in TEST_RECORDS]
+            )
+
+    def test_import_job_resume(self):
+        """A resumed job sends only the batches that failed"""
+        MockAPIHandler.failures = [None, HTTPStatus.BAD_REQUEST]
+        job = self.project.import_records(
+            TEST_RECORDS, batch_size=2, workers=1
+        )
+        self.assertEqual((job.completed, set(job.errors)), ({0, 2}, {1}))
+        job = self.project.import_records(TEST_RECORDS, job=job)
+        self.assertEqual((job.completed, job.errors), ({0, 1, 2}, {}))
+        self.assertEqual(job.count, 6)
+        self.assertEqual(
+            self.imported(),
+            [["1", "2"], ["3", "4"], ["5", "6"], ["3", "4"]]
+        )
+
+    def test_import_job_dirty(self):
+        """A dirty import sends changed fields, cleaning completed batches"""
+        records = self.project["record"]()
+        for record in records[:5]:
+            record.age = 99
+        del MockAPIHandler.requests[:]
+        MockAPIHandler.failures = [None, HTTPStatus.BAD_REQUEST]
+        job = self.project.import_records(
+            records, batch_size=2, workers=1, dirty=True
+        )
+        self.assertEqual((job.completed, set(job.errors)), ({0, 2}, {1}))
+        self.assertEqual(
+            [sorted(r.dirty) for r in records],
+            [[], [], ["age"], ["age"], [], []]
+        )
+        job = self.project.import_records(records, job=job, dirty=True)
+        self.assertEqual((job.completed, job.errors), ({0, 1, 2}, {}))
+        self.assertEqual(job.count, 5)
+        self.assertEqual(
+            self.imported(), [["1", "2"], ["3", "4"], ["5"], ["3", "4"]]
+        )
+        self.assertFalse(any(r.dirty for r in records))
+        for _, form in MockAPIHandler.requests:
+            if form.get("action") == ["import"]:
+                self.assertEqual(form["overwriteBehavior"], ["overwrite"])
+                for row in json_loads(form["data"][0]):
+                    self.assertEqual(row["age"], "99")
+                    self.assertEqual(sorted(row), ["age", "record_id"])
+
+    def test_import_job_parameters(self):
+        """Batches carry the job's import parameters"""
+        job = ImportJob(
+            self.project.connector, batch_size=4, workers=2,
+            overwriteBehavior="overwrite"
+        )
+        job.run(TEST_RECORDS)
+        self.assertEqual(job.count, 6)
+        self.assertEqual(sorted(self.imported()), [
+            ["1", "2", "3", "4"], ["5", "6"],
+        ])
+        for _, form in MockAPIHandler.requests:
+            if form.get("action") == ["import"]:
+                self.assertEqual(form["overwriteBehavior"], ["overwrite"])
+
+    def test_import_job_lazy(self):
+        """Rows are read as workers free up, over one socket per worker"""
+        rows = [dict(TEST_RECORDS[0], record_id=str(i)) for i in range(40)]
+        def read_rows():
+            for i, row in enumerate(rows):
+                # a batch is drawn only once an earlier one was answered
+                self.assertLessEqual(i // 2, len(self.imported()) + 2)
+                yield row
+        job = ImportJob(
+            LocalConnector(self.host, "/redcap/api/", "0" * 32),
+            batch_size=2, workers=2
+        )
+        self.assertEqual(job.run(read_rows()).count, 40)
+        ports = {
+            port for port, form in MockAPIHandler.requests
+            if form.get("action") == ["import"]
+        }
+        self.assertLessEqual(len(ports), 2)
 
 
 # test_suite = defaultTestLoader.loadTestsFromTestCase(TestBaseConnector)
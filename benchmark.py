@@ -0,0 +1,208 @@
+"""Benchmarks of pacder hot paths, run as `python -m pacder.benchmark`"""
+from argparse import ArgumentParser
+from http import server
+from json import (loads as json_loads, dumps as json_dumps)
+from random import Random
+from sys import stdout
+from threading import Thread
+from time import perf_counter
+
+from .__main__ import LocalConnector, MockAPIHandler
+from .metadata import COLUMNS, dump_metadatum, load_metadatum, Metadata
+from .record import Record
+
+
+VALIDATION_MIX = ( # (validation type, relative frequency)
+    ("", 8), ("integer", 3), ("number", 2), ("number_1dp", 2),
+    ("date_ymd", 2), ("date_mdy", 1), ("datetime_ymd", 1),
+    ("datetime_seconds_dmy", 1), ("time", 1), ("email", 1),
+)
+
+
+def synthetic_metadata(fields, forms=20, seed=0):
+    """return (raw metadata, field names) of a synthetic project"""
+    rng = Random(seed)
+    types = [t for t, n in VALIDATION_MIX for _ in range(n)]
+    raw_metadata, field_names = [], []
+    for i in range(fields):
+        name = "record_id" if i == 0 else "f{}".format(i)
+        validation = "" if i == 0 else rng.choice(types)
+        field_type = "text"
+        if validation == "" and i and rng.random() < 0.3:
+            field_type = "yesno"
+        metadatum = dict.fromkeys(COLUMNS, "")
+        metadatum.update({
+            COLUMNS[0]: name,
+            COLUMNS[1]: "form_{}".format(i * forms // fields),
+            COLUMNS[3]: field_type,
+            COLUMNS[4]: "Field {}".format(i),
+            COLUMNS[7]: validation,
+            COLUMNS[10]: "y" if rng.random() < 0.05 else "",
+        })
+        if i > 1 and rng.random() < 0.2:
+            metadatum[COLUMNS[11]] = "[f{}] = '1' or [f{}] <> ''".format(
+                rng.randrange(1, i), rng.randrange(1, i)
+            )
+        raw_metadata.append(metadatum)
+        field_names.append({
+            "original_field_name": name,
+            "choice_value": "",
+            "export_field_name": name,
+        })
+    return raw_metadata, field_names
+
+
+SYNTHETIC_VALUES = { # validation type -> value from a Random
+    "": lambda r: "text {}".format(r.randrange(10 ** 6)),
+    "integer": lambda r: str(r.randrange(-500, 5000)),
+    "number": lambda r: "{:.3f}".format(r.uniform(0, 1000)),
+    "number_1dp": lambda r: "{:.1f}".format(r.uniform(0, 1000)),
+    "date_ymd": lambda r: "20{:02}-{:02}-{:02}".format(
+        r.randrange(25), r.randrange(1, 13), r.randrange(1, 29)
+    ),
+    "date_mdy": lambda r: "{:02}-{:02}-20{:02}".format(
+        r.randrange(1, 13), r.randrange(1, 29), r.randrange(25)
+    ),
+    "datetime_ymd": lambda r: "20{:02}-{:02}-{:02} {:02}:{:02}".format(
+        r.randrange(25), r.randrange(1, 13), r.randrange(1, 29),
+        r.randrange(24), r.randrange(60)
+    ),
+    "datetime_seconds_dmy": lambda r: (
+        "{:02}-{:02}-20{:02} {:02}:{:02}:{:02}".format(
+            r.randrange(1, 29), r.randrange(1, 13), r.randrange(25),
+            r.randrange(24), r.randrange(60), r.randrange(60)
+        )
+    ),
+    "time": lambda r: "{:02}:{:02}".format(r.randrange(24), r.randrange(60)),
+    "email": lambda r: "user{}@example.org".format(r.randrange(10 ** 4)),
+}
+
+
+def synthetic_records(raw_metadata, records, blank=0.1, seed=0):
+    """return raw records matching a synthetic data dictionary"""
+    rng = Random(seed)
+    columns = [
+        (md[COLUMNS[0]], md[COLUMNS[3]], md[COLUMNS[7]])
+        for md in raw_metadata
+    ]
+    raw_records = []
+    for i in range(records):
+        raw_record = {}
+        for field, field_type, validation in columns:
+            if field == "record_id":
+                raw_record[field] = str(i + 1)
+            elif rng.random() < blank:
+                raw_record[field] = ""
+            elif field_type == "yesno":
+                raw_record[field] = rng.choice("01")
+            else:
+                raw_record[field] = SYNTHETIC_VALUES[validation](rng)
+        raw_records.append(raw_record)
+    return raw_records
+
+
+class BenchmarkProject:
+    """minimal project carrying metadata, for Record.for_project"""
+
+    def __init__(self, metadata):
+        """construct project"""
+        self.metadata = metadata
+
+
+def timed(func, repeat):
+    """return best wall time of `repeat` calls, in seconds"""
+    best = None
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        elapsed = perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def bench_metadata(fields, repeat):
+    """return timings of metadata load and dump, in seconds"""
+    raw_metadata, field_names = synthetic_metadata(fields)
+    loaded = [load_metadatum(md) for md in raw_metadata]
+    return {
+        "load_metadatum": timed(
+            lambda: [load_metadatum(md) for md in raw_metadata], repeat
+        ),
+        "dump_metadatum": timed(
+            lambda: [dump_metadatum(md) for md in loaded], repeat
+        ),
+        "Metadata": timed(
+            lambda: Metadata(raw_metadata, field_names=field_names), repeat
+        ),
+    }
+
+
+def bench_records(records, fields, repeat):
+    """return timings of export, decode, load, hydrate and serialize"""
+    raw_metadata, field_names = synthetic_metadata(fields)
+    raw_records = synthetic_records(raw_metadata, records)
+    MockAPIHandler.reset({
+        "metadata": json_dumps(raw_metadata).encode("utf-8"),
+        "exportFieldNames": json_dumps(field_names).encode("utf-8"),
+        "record": json_dumps(raw_records).encode("utf-8"),
+    })
+    service = server.ThreadingHTTPServer(("127.0.0.1", 0), MockAPIHandler)
+    Thread(target=service.serve_forever, daemon=True).start()
+    try:
+        connector = LocalConnector(
+            "127.0.0.1:{}".format(service.server_address[1]),
+            "/redcap/api/", "0"
+        )
+        request = connector.url_encode(action="export", content="record")
+        with connector:
+            post = timed(lambda: connector.post(request).read(), repeat)
+            body = connector.post(request).read()
+    finally:
+        service.shutdown()
+        service.server_close()
+        MockAPIHandler.reset()
+    decoded = json_loads(body)
+    metadata = Metadata(raw_metadata, field_names=field_names)
+    record_cls = Record.for_project(BenchmarkProject(metadata))
+    hydrated = [record_cls(r) for r in decoded]
+    return {
+        "response_octets": len(body),
+        "BaseConnector.post": post,
+        "json_decode": timed(lambda: json_loads(body), repeat),
+        "Metadata": timed(
+            lambda: Metadata(raw_metadata, field_names=field_names), repeat
+        ),
+        "Record.for_project": timed(
+            lambda: Record.for_project(BenchmarkProject(metadata)), repeat
+        ),
+        "Record.__init__": timed(
+            lambda: [record_cls(r) for r in decoded], repeat
+        ),
+        "Record.__str__": timed(
+            lambda: [str(r) for r in hydrated], repeat
+        ),
+    }
+
+
+def main(argv=None):
+    """run benchmarks and write JSON results to stdout"""
+    parser = ArgumentParser(description=__doc__)
+    parser.add_argument("--fields", type=int, default=10000)
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--record-fields", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+    results = {
+        "parameters": vars(args),
+        "metadata": bench_metadata(args.fields, args.repeat),
+        "records": bench_records(
+            args.records, args.record_fields, args.repeat
+        ),
+    }
+    stdout.write(json_dumps(results, indent=2) + "\n")
+    return results
+
+
+if __name__ == "__main__":
+    main()
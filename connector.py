@@ -1,10 +1,35 @@
 """Connector objects"""
+from asyncio import (
+    ensure_future, gather, open_connection, Semaphore, sleep as async_sleep
+)
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from email.utils import parsedate_to_datetime
+from gzip import compress as gzip_compress
 from http import client, HTTPStatus
+from io import RawIOBase
+from itertools import islice
+from json import dumps as json_dumps, loads as json_loads
 from logging import getLogger
+from queue import Empty, LifoQueue
+from random import random
+from select import select
+from ssl import create_default_context
+from threading import BoundedSemaphore, local, Lock
+from time import monotonic, sleep, time
 from urllib.parse import urlencode
+from zlib import (
+    decompress as zlib_decompress, decompressobj, error as ZlibError,
+    MAX_WBITS
+)
 
+from .util import CHUNK_SIZE
 
-__all__ = ["Connector",]
+
+__all__ = [
+    "AsyncConnector", "Connector", "ConnectorPool", "ImportJob",
+    "RequestEvent", "RetryPolicy", "TokenBucket",
+]
 
 
 LOGGER = getLogger(__name__)
@@ -24,13 +49,336 @@ PARAMETERS = [
 ]
 
 
+def session_parameters(token, **kwargs):
+    """Return validated parameters sent with every request"""
+    parameters = {"token": token, "format": kwargs.pop("format", "json")}
+    for k,v in kwargs.items():
+        if k in PARAMETERS:
+            parameters[k] = v
+        else: raise Exception("bad API parameter")
+    return parameters
+
+
+def id_parameters(record_id, parameters):
+    """Return export parameters fetching only the record-ID field"""
+    parameters = {
+        k: v for k,v in parameters.items()
+        if k not in ("fields", "forms", "format")
+    }
+    parameters.update(fields=[record_id], format="json")
+    return parameters
+
+
+def batch_record_ids(body, record_id, batch_size):
+    """Split an exported record-ID list into ordered batches"""
+    records = json_loads(body)
+    if not isinstance(records, list):
+        raise Exception("record ID export failed: {}".format(records))
+    record_ids = list(dict.fromkeys(r[record_id] for r in records))
+    return [
+        record_ids[i:i + batch_size]
+        for i in range(0, len(record_ids), batch_size)
+    ]
+
+
+def checked_body(resp):
+    """Return the body of a 200 response, raise for any other status"""
+    body = resp.read()
+    if resp.status != HTTPStatus.OK:
+        raise Exception("export failed: status={}, body={!r}".format(
+            resp.status, body[:200]
+        ))
+    return body
+
+
+def map_bounded(executor, func, items, workers):
+    """Return `func(item)` for items, submitting `workers` at a time
+
+    Items are drawn as workers free up, so a long iterable is read lazily
+    and a slow item only holds up its own worker.
+    """
+    slots, futures = BoundedSemaphore(workers), []
+    for item in items:
+        slots.acquire()
+        future = executor.submit(func, item)
+        future.add_done_callback(lambda _: slots.release())
+        futures.append(future)
+    return [future.result() for future in futures]
+
+
+def read_data(data):
+    """Return import data from a file-like, str or bytes object"""
+    if hasattr(data, "read"):
+        data = data.read()
+    return data
+
+
+def merge_exports(parts, fmt="json"):
+    """Concatenate batched export bodies in order"""
+    if fmt == "csv":
+        rows = []
+        for i, part in enumerate(p.strip() for p in parts):
+            if i > 0:
+                part = part.partition(b"\n")[2]
+            if part:
+                rows.append(part)
+        return b"\n".join(rows) + b"\n" if rows else b""
+    items = [p.strip()[1:-1].strip() for p in parts]
+    return b"[" + b",".join(i for i in items if i) + b"]"
+
+
+DECODERS = {"gzip": 16 + MAX_WBITS, "deflate": MAX_WBITS}
+
+
+def decompress(body, encoding):
+    """Return body decoded from a gzip or deflate content-encoding"""
+    if encoding not in DECODERS:
+        return body
+    try:
+        return zlib_decompress(body, DECODERS[encoding])
+    except ZlibError:
+        if encoding != "deflate":
+            raise
+        return zlib_decompress(body, -MAX_WBITS) # raw deflate stream
+
+
+class DecodedResponse(RawIOBase):
+    """Response wrapper decompressing the body as it is read"""
+
+    def __init__(self, response):
+        """Construct wrapper around an unread HTTPResponse"""
+        super().__init__()
+        self.response = response
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+        self.encoding = response.headers["content-encoding"]
+        self.decoder = None
+        self.buffer = bytearray()
+        self.eof = False
+
+    def close(self):
+        """Close wrapped response"""
+        self.response.close()
+        super().close()
+
+    def decompress_chunk(self, max_length=0):
+        """Return up to `max_length` more decoded bytes (0 is no limit)"""
+        if self.decoder is not None and self.decoder.unconsumed_tail:
+            data = self.decoder.unconsumed_tail
+        else:
+            data = self.response.read(CHUNK_SIZE)
+            if not data:
+                self.eof = True
+                return self.decoder.flush() if self.decoder else b""
+        if self.decoder is None:
+            wbits = DECODERS[self.encoding]
+            if self.encoding == "deflate" and data[0] & 0x0f != 8:
+                wbits = -MAX_WBITS # raw deflate stream
+            self.decoder = decompressobj(wbits)
+        return self.decoder.decompress(data, max_length)
+
+    def getheaders(self):
+        """Return wrapped response headers"""
+        return self.response.getheaders()
+
+    def isclosed(self):
+        """Return True if the wrapped response is closed"""
+        return self.response.isclosed()
+
+    def read(self, amt=None):
+        """Return up to `amt` decoded bytes, or all if `amt` is None"""
+        if amt is None or amt < 0:
+            chunks = [bytes(self.buffer)]
+            del self.buffer[:]
+            while not self.eof:
+                chunks.append(self.decompress_chunk())
+            return b"".join(chunks)
+        while len(self.buffer) < amt and not self.eof:
+            self.buffer += self.decompress_chunk(amt - len(self.buffer))
+        data = bytes(self.buffer[:amt])
+        del self.buffer[:amt]
+        return data
+
+    def readable(self):
+        """Return True"""
+        return True
+
+    def readinto(self, b):
+        """Read decoded bytes into a writable buffer"""
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+class RequestEvent:
+    """Timing, status and sizes of one request, passed to instruments
+
+    An instrument is any object with `request_started(event)` and
+    `request_finished(event)` methods. Blocking requests finish once
+    the response body has been read, asyncio requests once received.
+    `response_octets` counts the body as received, before decoding.
+    """
+
+    __slots__ = (
+        "content", "action", "request_octets", "started", "ttfb",
+        "elapsed", "status", "redirects", "retries", "response_octets",
+        "error",
+    )
+
+    def __init__(self, content, action, request_octets):
+        """Construct event, starting its clock"""
+        self.content = content
+        self.action = action
+        self.request_octets = request_octets
+        self.started = monotonic()
+        self.ttfb = self.elapsed = self.status = self.error = None
+        self.redirects = self.retries = self.response_octets = 0
+
+    def finish(self, instrument, error=None):
+        """Stop clock and report event to `instrument`"""
+        if self.elapsed is not None:
+            return
+        self.elapsed = monotonic() - self.started
+        if error is not None:
+            self.error = repr(error)
+        self.notify(instrument.request_finished)
+
+    def notify(self, hook):
+        """Call an instrument hook, never failing the request"""
+        try:
+            hook(self)
+        except Exception:
+            LOGGER.exception("instrument hook failed: hook=%s", hook)
+
+
+class InstrumentedResponse(RawIOBase):
+    """Response wrapper finishing its RequestEvent once read"""
+
+    def __init__(self, response, event, instrument):
+        """Construct wrapper around an unread response"""
+        super().__init__()
+        self.response = response
+        self.event = event
+        self.instrument = instrument
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+    def close(self):
+        """Close wrapped response, finishing the event"""
+        self.event.finish(self.instrument)
+        self.response.close()
+        super().close()
+
+    def getheaders(self):
+        """Return wrapped response headers"""
+        return self.response.getheaders()
+
+    def isclosed(self):
+        """Return True if the wrapped response is closed"""
+        return self.response.isclosed()
+
+    def read(self, amt=None):
+        """Return up to `amt` bytes, or all if `amt` is None"""
+        data = self.response.read(amt)
+        self.event.response_octets += len(data)
+        if amt is None or amt < 0 or not data:
+            self.event.finish(self.instrument)
+        return data
+
+    def readable(self):
+        """Return True"""
+        return True
+
+    def readinto(self, b):
+        """Read bytes into a writable buffer"""
+        data = self.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+class RetryPolicy:
+    """Exponential backoff schedule for failed requests"""
+
+    def __init__(
+        self, retries=3, backoff=0.5, max_backoff=60.0, jitter=0.5,
+        statuses=(429, 502, 503, 504), unprocessed_statuses=(429, 503)
+    ):
+        """Construct policy; `retries` of 0 disables retrying
+
+        Imports are not idempotent, so they are only retried on the
+        `unprocessed_statuses` among `statuses`, which signal that the
+        server refused the request, or when it was never sent.
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.statuses = frozenset(statuses)
+        self.unprocessed_statuses = self.statuses & frozenset(
+            unprocessed_statuses
+        )
+
+    def retry_statuses(self, idempotent=True):
+        """Return statuses to retry a request on"""
+        if idempotent:
+            return self.statuses
+        return self.unprocessed_statuses
+
+    def delay(self, attempt, retry_after=None):
+        """Return seconds to wait before retry number `attempt + 1`"""
+        if retry_after:
+            try:
+                return max(0.0, float(retry_after))
+            except ValueError:
+                try:
+                    when = parsedate_to_datetime(retry_after)
+                except (TypeError, ValueError):
+                    when = None
+                if when is not None:
+                    return max(0.0, when.timestamp() - time())
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        return delay * (1 - self.jitter * random())
+
+
+class TokenBucket:
+    """Thread-safe request rate limiter shared between connectors"""
+
+    def __init__(self, rate, burst=None):
+        """Construct bucket allowing `rate` requests per second"""
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.stamp = monotonic()
+        self.lock = Lock()
+
+    def reserve(self, tokens=1):
+        """Take tokens, returning seconds to wait before using them"""
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.stamp) * self.rate
+            )
+            self.stamp = now
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+
 class BaseConnector(client.HTTPSConnection):
     """HTTP methods container"""
 
     path_stack = []
     max_redirects = 50
+    instrument = None
+    rate_limiter = None
+    retry_policy = RetryPolicy()
+    compress_requests = False
     static_headers = {
         "accept": "application/json",
+        "accept-encoding": "gzip, deflate",
         "content-type": "application/x-www-form-urlencoded",
     }
 
@@ -44,31 +392,72 @@ class BaseConnector(client.HTTPSConnection):
         """Exit context"""
         self.close()
     
-    def post(self, body):
-        """Handle HTTP POST procedure"""
+    def post(self, body, headers=None, content=None, action=None):
+        """Handle HTTP POST procedure, reporting to self.instrument"""
+        idempotent = action != "import"
+        if self.instrument is None:
+            return self.dispatch(body, headers, idempotent=idempotent)
+        event = RequestEvent(content, action, len(body))
+        event.notify(self.instrument.request_started)
         try:
-            self.putrequest(
-                method="POST", url=self.path_stack[-1]
-            )
-            for k,v in self.static_headers.items():
-                self.putheader(k,v)
-            self.putheader("content-length", len(body))
-            self.endheaders(message_body=body)
+            response = self.dispatch(body, headers, event, idempotent)
         except Exception as e:
-            LOGGER.exception("request threw exception: exc=%s", e)
-            if isinstance(e, client.NotConnected):
-                try:
-                    LOGGER.info("trying to reconnect")
-                    self.connect()
-                    self.post(body=body)
-                except client.NotConnected:
-                    LOGGER.error("unable to connect")
+            event.finish(self.instrument, e)
+            raise
+        event.status = response.status
+        if isinstance(response, DecodedResponse): # count octets received
+            response.response = InstrumentedResponse(
+                response.response, event, self.instrument
+            )
+            return response
+        return InstrumentedResponse(response, event, self.instrument)
+
+    def dispatch(self, body, headers=None, event=None, idempotent=True):
+        """Send POST, following redirects and retrying per policy"""
+        attempt, redirects = 0, self.max_redirects
+        statuses = self.retry_policy.retry_statuses(idempotent)
+        while True:
+            if self.rate_limiter is not None:
+                sleep(self.rate_limiter.reserve())
+            sent = False
+            try:
+                self.putrequest(
+                    method="POST", url=self.path_stack[-1],
+                    skip_accept_encoding=True # static_headers set it
+                )
+                for k,v in self.static_headers.items():
+                    self.putheader(k,v)
+                for k,v in (headers or {}).items():
+                    self.putheader(k,v)
+                self.putheader("content-length", len(body))
+                self.endheaders(message_body=body)
+                sent = True # a failed write can't have been acted upon
+                response = self.getresponse()
+            except (client.HTTPException, OSError) as e:
+                # reset socket and state so the next attempt reconnects
+                self.close()
+                if attempt >= self.retry_policy.retries or (
+                    sent and not idempotent
+                ):
+                    LOGGER.exception("request threw exception: exc=%s", e)
                     raise
-        else:
-            response = self.getresponse()
+                delay = self.retry_policy.delay(attempt)
+                LOGGER.warning(
+                    "request threw exception, retrying: exc=%s, delay=%.2f",
+                    e, delay
+                )
+                attempt += 1
+                if event is not None:
+                    event.retries += 1
+                sleep(delay)
+                continue
+            if event is not None:
+                event.ttfb = monotonic() - event.started
             response.headers = {
                 k.lower(): v for k,v in response.getheaders()
             }
+            if response.headers.get("content-encoding") in DECODERS:
+                response = DecodedResponse(response)
             if (
                 HTTPStatus.OK
                 <= response.status <
@@ -80,7 +469,6 @@ class BaseConnector(client.HTTPSConnection):
                 )
                 if self.path_stack[-1] != self.path_stack[0]:
                     self.path_stack.append(self.path_stack[0])
-                self.max_redirects = 50
                 return response
             elif (
                 HTTPStatus.MULTIPLE_CHOICES
@@ -96,37 +484,39 @@ class BaseConnector(client.HTTPSConnection):
                 self.path_stack.append(
                     response.headers.get("location")
                 )
-                if self.max_redirects > 0:
-                    self.max_redirects -= 1
-                    self.post(body=body)
-                else:
-                    LOGGER.exception("too many redirects")
+                if redirects <= 0:
+                    LOGGER.error("too many redirects")
                     raise Exception("too many redirects")
-            elif response.status >= HTTPStatus.BAD_REQUEST:
-                # 400s and 500s compacted into one elif for now
-                # TODO: perform certain retries
+                redirects -= 1
+                if event is not None:
+                    event.redirects += 1
+            elif (
+                response.status in statuses
+                and attempt < self.retry_policy.retries
+            ):
+                response.read() # drain so the socket can be reused
+                delay = self.retry_policy.delay(
+                    attempt, response.headers.get("retry-after")
+                )
+                LOGGER.warning(
+                    "retrying request: status=%i, attempt=%i, delay=%.2f",
+                    response.status, attempt + 1, delay
+                )
+                attempt += 1
+                if event is not None:
+                    event.retries += 1
+                sleep(delay)
+            else:
                 # TODO: verify REDCap exceptions are tied to 400s/500s
                 LOGGER.error(
                     "erroneous request: status=%i, reason=%s",
                     response.status, response.reason
                 )
                 return response
-            
 
-class Connector(BaseConnector):
-    """WIP REDCap methods container"""
 
-    def __init__(self, host, path, token, **kwargs):
-        """Construct interface"""
-        super().__init__(host)
-        self.path_stack.append(path)
-        self.session_parameters = {
-            "token": token, "format": kwargs.pop("format", "json")
-        }
-        for k,v in kwargs.items():
-            if k in PARAMETERS:
-                self.session_parameters[k] = v
-            else: raise Exception("bad API parameter")
+class ContentMethods:
+    """REDCap content methods shared by connector objects"""
 
     def url_encode(self, **parameters):
         """Return url-encoded body bytes"""
@@ -135,52 +525,49 @@ class Connector(BaseConnector):
             if key not in PARAMETERS:
                 raise Exception("bad API parameter")
             body[key] = value
-        return urlencode(body).encode("latin-1")
+        pairs = []
+        for key, value in body.items():
+            if isinstance(value, (list, tuple)):
+                pairs.extend(
+                    ("{}[{}]".format(key, i), v)
+                    for i, v in enumerate(value)
+                )
+            else:
+                pairs.append((key, value))
+        return urlencode(pairs).encode("latin-1")
 
-    def delete_content(self, content, **parameters):
-        """Delete content"""
-        if "data" in parameters:
-            raise Exception("can't delete with data")
-        body = self.url_encode(
-            action="delete", content=content, **parameters
-        )
-        resp = self.post(body)
-        LOGGER.info(
-            "delete resource: status=%i, content=%s",
-            resp.status,
-            content
-        )
-        return resp.read()
-        
-    def export_content(self, content, **parameters):
-        """Export content"""
-        if "data" in parameters:
-            raise Exception("can't export with data")
-        body = self.url_encode(
-            action="export", content=content, **parameters
+    def export_partitioned(
+        self, batch_size=1000, workers=4, record_id=None, **parameters
+    ):
+        """Export records in record-ID batches over several connections"""
+        if "records" in parameters:
+            raise Exception("can't partition an explicit record list")
+        fmt = parameters.get("format", self.session_parameters.get("format"))
+        if fmt not in ("json", "csv"):
+            raise Exception("partitioned export needs json or csv")
+        if record_id is None:
+            record_id = json_loads(
+                self.field_names("export", format="json")
+            )[0]["original_field_name"]
+        batches = batch_record_ids(
+            self.records(
+                "export", **id_parameters(record_id, parameters)
+            ),
+            record_id,
+            batch_size
         )
-        resp = self.post(body)
         LOGGER.info(
-            "export resource: status=%i, content=%s",
-            resp.status,
-            content
+            "partitioned export: batches=%i, workers=%s",
+            len(batches), workers
         )
-        return resp.read()
+        def export_batch(conn, batch):
+            with closing(conn.records(
+                "stream", records=batch, **parameters
+            )) as resp:
+                return checked_body(resp)
+        parts = self.map_concurrent(export_batch, batches, workers)
+        return merge_exports(parts, fmt)
 
-    def import_content(self, content, data, **parameters):
-        """Import content"""
-        # TODO: Check if format param agrees w actual data
-        body = self.url_encode(
-            action="import", content=content, **parameters
-        )
-        resp = self.post(body)
-        LOGGER.info(
-            "import resource: status=%i, content=%s",
-            resp.status,
-            content
-        )
-        return resp.read()
-        
     def arms(self, action, **parameters):
         """Modify arms"""
         return getattr(self, "{}_content".format(action))(
@@ -258,3 +645,649 @@ class Connector(BaseConnector):
         return getattr(self, "{}_content".format(action))(
             content="users", **parameters
         )
+
+
+class Connector(ContentMethods, BaseConnector):
+    """WIP REDCap methods container"""
+
+    def __init__(
+        self, host, path, token, retry_policy=None, rate_limiter=None,
+        compress_requests=None, instrument=None, **kwargs
+    ):
+        """Construct interface"""
+        super().__init__(host)
+        self.path_stack = [path]
+        self.session_parameters = session_parameters(token, **kwargs)
+        if instrument is not None:
+            self.instrument = instrument
+        if retry_policy is not None:
+            self.retry_policy = retry_policy
+        if rate_limiter is not None:
+            self.rate_limiter = rate_limiter
+        if compress_requests is not None:
+            self.compress_requests = compress_requests
+
+    def copy(self):
+        """Return an unconnected connector with the same session"""
+        parameters = self.session_parameters.copy()
+        return type(self)(
+            "{}:{}".format(self.host, self.port), self.path_stack[0],
+            parameters.pop("token"), retry_policy=self.retry_policy,
+            rate_limiter=self.rate_limiter,
+            compress_requests=self.compress_requests,
+            instrument=self.instrument, **parameters
+        )
+
+    def map_concurrent(self, func, items, workers=4):
+        """Return `func(connector, item)` for items, one copy per thread"""
+        connectors, threads = [], local()
+        def call(item):
+            conn = getattr(threads, "connector", None)
+            if conn is None:
+                conn = threads.connector = self.copy()
+                connectors.append(conn)
+            return func(conn, item)
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return map_bounded(executor, call, items, workers)
+        finally:
+            for conn in connectors:
+                conn.close()
+
+    def delete_content(self, content, **parameters):
+        """Delete content"""
+        if "data" in parameters:
+            raise Exception("can't delete with data")
+        body = self.url_encode(
+            action="delete", content=content, **parameters
+        )
+        resp = self.post(body, content=content, action="delete")
+        LOGGER.info(
+            "delete resource: status=%i, content=%s",
+            resp.status,
+            content
+        )
+        return resp.read()
+        
+    def export_content(self, content, **parameters):
+        """Export content"""
+        if "data" in parameters:
+            raise Exception("can't export with data")
+        body = self.url_encode(
+            action="export", content=content, **parameters
+        )
+        resp = self.post(body, content=content, action="export")
+        LOGGER.info(
+            "export resource: status=%i, content=%s",
+            resp.status,
+            content
+        )
+        return resp.read()
+
+    def import_content(self, content, data, **parameters):
+        """Import content"""
+        # TODO: Check if format param agrees w actual data
+        body = self.url_encode(
+            action="import", content=content, data=read_data(data),
+            **parameters
+        )
+        if self.compress_requests:
+            resp = self.post(
+                gzip_compress(body), headers={"content-encoding": "gzip"},
+                content=content, action="import"
+            )
+            if resp.status == HTTPStatus.UNSUPPORTED_MEDIA_TYPE:
+                LOGGER.info("server refused gzip body, sending identity")
+                resp.read()
+                self.compress_requests = False
+                resp = self.post(body, content=content, action="import")
+        else:
+            resp = self.post(body, content=content, action="import")
+        LOGGER.info(
+            "import resource: status=%i, content=%s",
+            resp.status,
+            content
+        )
+        return resp.read()
+
+    def stream_content(self, content, **parameters):
+        """Export content, returning the unread response"""
+        if "data" in parameters:
+            raise Exception("can't export with data")
+        body = self.url_encode(
+            action="export", content=content, **parameters
+        )
+        resp = self.post(body, content=content, action="export")
+        LOGGER.info(
+            "stream resource: status=%i, content=%s",
+            resp.status,
+            content
+        )
+        return resp
+
+
+def is_alive(conn):
+    """Return False if an idle connection was dropped by the peer"""
+    if conn.sock is None:
+        return True
+    try:
+        readable, _, _ = select([conn.sock], [], [], 0)
+    except (OSError, ValueError):
+        return False
+    # an idle keep-alive socket only turns readable on EOF or junk
+    return not readable
+
+
+class ConnectorPool(ContentMethods):
+    """Thread-safe pool of keep-alive connectors"""
+
+    def __enter__(self):
+        """Enter context"""
+        return self
+
+    def __exit__(self, typ, val, trb):
+        """Exit context, keeping the pooled sockets open"""
+        pass
+
+    def __init__(self, host, path, token, size=4, **kwargs):
+        """Construct pool of at most `size` connections"""
+        self.prototype = Connector(host, path, token, **kwargs)
+        self.session_parameters = self.prototype.session_parameters
+        self.size = 0
+        self.idle = LifoQueue()
+        self.lock = Lock()
+        self.grow(size)
+
+    def close(self):
+        """Close every idle connection"""
+        drained = []
+        while True:
+            try:
+                drained.append(self.idle.get_nowait())
+            except Empty:
+                break
+        for conn in drained:
+            if conn is not None:
+                conn.close()
+            self.idle.put(conn)
+
+    def grow(self, size):
+        """Raise the pool's capacity to `size` connections"""
+        with self.lock:
+            for _ in range(size - self.size):
+                self.idle.put(None) # placeholder, connected on demand
+            self.size = max(size, self.size)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """Check out a healthy connector, returning it afterward"""
+        conn = self.idle.get(timeout=timeout)
+        try:
+            if conn is None:
+                conn = self.prototype.copy()
+            elif not is_alive(conn):
+                LOGGER.info("replacing dead connection")
+                conn.close()
+            yield conn
+        except BaseException:
+            # a half-read response leaves the socket unusable
+            if conn is not None:
+                conn.close()
+            raise
+        finally:
+            self.idle.put(conn)
+
+    def call(self, method, *args, **kwargs):
+        """Run a connector method on a pooled connection"""
+        with self.connection() as conn:
+            return getattr(conn, method)(*args, **kwargs)
+
+    def map_concurrent(self, func, items, workers=None):
+        """Return `func(connector, item)` for items over pooled sockets"""
+        def call(item):
+            with self.connection() as conn:
+                return func(conn, item)
+        workers = workers or self.size
+        self.grow(workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return map_bounded(executor, call, items, workers)
+
+    def delete_content(self, content, **parameters):
+        """Delete content"""
+        return self.call("delete_content", content, **parameters)
+
+    def export_content(self, content, **parameters):
+        """Export content"""
+        return self.call("export_content", content, **parameters)
+
+    def import_content(self, content, data, **parameters):
+        """Import content"""
+        return self.call("import_content", content, data, **parameters)
+
+
+class ImportJob:
+    """Resumable import of rows in concurrent batches"""
+
+    def __init__(
+        self, connector, content="record", batch_size=500, workers=4,
+        completed=(), **parameters
+    ):
+        """Construct job, skipping batch indexes in `completed`"""
+        self.connector = connector
+        self.content = content
+        self.batch_size = batch_size
+        self.workers = workers
+        self.parameters = parameters
+        self.completed = set(completed)
+        self.counts = {}
+        self.errors = {}
+        self.pairs = None # (record, row) of a dirty import, fixed once
+
+    @property
+    def count(self):
+        """Return number of rows the server reported as imported"""
+        return sum(self.counts.values())
+
+    def batches(self, rows):
+        """Yield (index, rows) of batches not yet completed"""
+        rows, index = iter(rows), 0
+        while True:
+            batch = list(islice(rows, self.batch_size))
+            if not batch:
+                return
+            if index not in self.completed:
+                yield index, batch
+            index += 1
+
+    def import_batch(self, conn, item):
+        """Serialize and send one batch, recording the outcome"""
+        index, batch = item
+        data = "[" + ", ".join(
+            r if isinstance(r, str) else json_dumps(r) for r in batch
+        ) + "]"
+        try:
+            resp = json_loads(conn.import_content(
+                self.content, data, format="json", returnFormat="json",
+                **self.parameters
+            ))
+        except Exception as e:
+            LOGGER.exception("batch failed: index=%i", index)
+            self.errors[index] = str(e)
+            return
+        if isinstance(resp, dict) and "error" in resp:
+            LOGGER.error(
+                "batch rejected: index=%i, error=%s", index, resp["error"]
+            )
+            self.errors[index] = resp["error"]
+            return
+        self.counts[index] = (
+            int(resp["count"]) if isinstance(resp, dict) else len(resp)
+        )
+        self.errors.pop(index, None)
+        self.completed.add(index)
+
+    def run(self, rows):
+        """Import rows, `workers` batches at a time"""
+        self.connector.map_concurrent(
+            self.import_batch, self.batches(rows), self.workers
+        )
+        LOGGER.info(
+            "import job: count=%i, batches=%i, errors=%i",
+            self.count, len(self.completed), len(self.errors)
+        )
+        return self
+
+
+class AsyncResponse:
+    """Fully read HTTP response from an AsyncConnector"""
+
+    def __init__(self, status, reason, headers, body, octets=None):
+        """Construct response; `octets` is the body size as received"""
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.body = body
+        self.octets = len(body) if octets is None else octets
+
+    def read(self):
+        """Return response body bytes"""
+        return self.body
+
+
+class AsyncConnector(ContentMethods):
+    """asyncio REDCap methods container"""
+
+    compress_requests = False
+    instrument = None
+    max_redirects = 50
+    rate_limiter = None
+    retry_policy = BaseConnector.retry_policy
+    static_headers = BaseConnector.static_headers
+
+    def __init__(
+        self, host, path, token, port=None, ssl=True, limit=100,
+        retry_policy=None, rate_limiter=None, compress_requests=None,
+        instrument=None, **kwargs
+    ):
+        """Construct interface"""
+        if port is None and ":" in host:
+            host, port = host.rsplit(":", 1)
+        self.host = host
+        self.port = int(port or (443 if ssl else 80))
+        self.ssl = create_default_context() if ssl is True else ssl
+        self.path_stack = [path]
+        self.session_parameters = session_parameters(token, **kwargs)
+        self.idle = []
+        self.limit = limit
+        self.semaphore = None
+        if instrument is not None:
+            self.instrument = instrument
+        if retry_policy is not None:
+            self.retry_policy = retry_policy
+        if rate_limiter is not None:
+            self.rate_limiter = rate_limiter
+        if compress_requests is not None:
+            self.compress_requests = compress_requests
+
+    async def __aenter__(self):
+        """Enter context"""
+        return self
+
+    async def __aexit__(self, typ, val, trb):
+        """Exit context"""
+        await self.close()
+
+    async def close(self):
+        """Close every idle connection"""
+        idle, self.idle = self.idle, []
+        for reader, writer in idle:
+            writer.close()
+        for reader, writer in idle:
+            if hasattr(writer, "wait_closed"): # Python 3.7+
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+
+    async def open_connection(self):
+        """Return an idle or new (reader, writer) stream pair"""
+        while self.idle:
+            reader, writer = self.idle.pop()
+            if not reader.at_eof():
+                return reader, writer, True
+            writer.close()
+        reader, writer = await open_connection(
+            self.host, self.port, ssl=self.ssl or None
+        )
+        return reader, writer, False
+
+    async def request(
+        self, path, body, headers=None, streams=None, idempotent=True
+    ):
+        """Send one POST on `streams` or a new connection"""
+        reader, writer, reused = streams or await self.open_connection()
+        try:
+            host = self.host
+            if self.port not in (80, 443):
+                host = "{}:{}".format(host, self.port)
+            head = ["POST {} HTTP/1.1".format(path), "host: " + host]
+            head.extend(
+                "{}: {}".format(k, v) for k,v in self.static_headers.items()
+            )
+            head.extend(
+                "{}: {}".format(k, v) for k,v in (headers or {}).items()
+            )
+            head.append("content-length: {}".format(len(body)))
+            writer.write(
+                ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + body
+            )
+            await writer.drain()
+            status_line = await reader.readline()
+            if not status_line:
+                raise client.RemoteDisconnected("connection closed")
+            _, status, reason = (
+                status_line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+                + [""]
+            )[:3]
+            resp_headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                k, _, v = line.decode("latin-1").partition(":")
+                resp_headers[k.strip().lower()] = v.strip()
+            if resp_headers.get("transfer-encoding", "").lower() == "chunked":
+                chunks = []
+                while True:
+                    size = int(
+                        (await reader.readline()).split(b";")[0], 16
+                    )
+                    if size == 0:
+                        while (await reader.readline()) not in (
+                            b"\r\n", b"\n", b""
+                        ):
+                            pass
+                        break
+                    chunks.append(await reader.readexactly(size))
+                    await reader.readline()
+                data = b"".join(chunks)
+            elif "content-length" in resp_headers:
+                data = await reader.readexactly(
+                    int(resp_headers["content-length"])
+                )
+            else:
+                data = await reader.read()
+                resp_headers["connection"] = "close"
+        except (client.RemoteDisconnected, ConnectionError) as e:
+            writer.close()
+            if not reused or not idempotent:
+                raise
+            # keep-alive socket went stale while idle
+            LOGGER.info("retrying on fresh connection: exc=%s", e)
+            return await self.request(path, body, headers, (
+                await self.open_connection()
+            ))
+        except BaseException:
+            writer.close()
+            raise
+        if resp_headers.get("connection", "").lower() == "close":
+            writer.close()
+        else:
+            self.idle.append((reader, writer))
+        return AsyncResponse(
+            int(status), reason, resp_headers,
+            decompress(data, resp_headers.get("content-encoding")), len(data)
+        )
+
+    async def post(self, body, headers=None, content=None, action=None):
+        """Handle HTTP POST procedure, reporting to self.instrument"""
+        idempotent = action != "import"
+        if self.instrument is None:
+            return await self.dispatch(
+                body, headers, idempotent=idempotent
+            )
+        event = RequestEvent(content, action, len(body))
+        event.notify(self.instrument.request_started)
+        try:
+            response = await self.dispatch(body, headers, event, idempotent)
+        except Exception as e:
+            event.finish(self.instrument, e)
+            raise
+        event.status = response.status
+        event.response_octets = response.octets
+        event.finish(self.instrument)
+        return response
+
+    async def dispatch(self, body, headers=None, event=None, idempotent=True):
+        """Send POST, following redirects and retrying per policy"""
+        if self.semaphore is None:
+            self.semaphore = Semaphore(self.limit)
+        path, attempt, redirects = self.path_stack[0], 0, self.max_redirects
+        statuses = self.retry_policy.retry_statuses(idempotent)
+        async with self.semaphore:
+            while True:
+                if self.rate_limiter is not None:
+                    await async_sleep(self.rate_limiter.reserve())
+                sent = False
+                try:
+                    streams = await self.open_connection()
+                    sent = True # the server may act on the request
+                    response = await self.request(
+                        path, body, headers, streams, idempotent
+                    )
+                except (client.HTTPException, OSError) as e:
+                    if attempt >= self.retry_policy.retries or (
+                        sent and not idempotent
+                    ):
+                        LOGGER.exception(
+                            "request threw exception: exc=%s", e
+                        )
+                        raise
+                    delay = self.retry_policy.delay(attempt)
+                    attempt += 1
+                    if event is not None:
+                        event.retries += 1
+                    await async_sleep(delay)
+                    continue
+                if event is not None:
+                    event.ttfb = monotonic() - event.started
+                if (
+                    HTTPStatus.MULTIPLE_CHOICES
+                    <= response.status <
+                    HTTPStatus.BAD_REQUEST
+                ):
+                    if redirects <= 0:
+                        LOGGER.error("too many redirects")
+                        raise Exception("too many redirects")
+                    redirects -= 1
+                    if event is not None:
+                        event.redirects += 1
+                    path = response.headers.get("location")
+                    LOGGER.info("following redirect: link=%s", path)
+                elif (
+                    response.status in statuses
+                    and attempt < self.retry_policy.retries
+                ):
+                    delay = self.retry_policy.delay(
+                        attempt, response.headers.get("retry-after")
+                    )
+                    LOGGER.warning(
+                        "retrying request: status=%i, attempt=%i, "
+                        "delay=%.2f", response.status, attempt + 1, delay
+                    )
+                    attempt += 1
+                    if event is not None:
+                        event.retries += 1
+                    await async_sleep(delay)
+                else:
+                    break
+        if response.status >= HTTPStatus.BAD_REQUEST:
+            LOGGER.error(
+                "erroneous request: status=%i, reason=%s",
+                response.status, response.reason
+            )
+        else:
+            LOGGER.info(
+                "response received sucessfully: octets=%s",
+                len(response.body)
+            )
+        return response
+
+    async def delete_content(self, content, **parameters):
+        """Delete content"""
+        if "data" in parameters:
+            raise Exception("can't delete with data")
+        body = self.url_encode(
+            action="delete", content=content, **parameters
+        )
+        resp = await self.post(body, content=content, action="delete")
+        LOGGER.info(
+            "delete resource: status=%i, content=%s",
+            resp.status,
+            content
+        )
+        return resp.read()
+
+    async def export_content(self, content, **parameters):
+        """Export content"""
+        if "data" in parameters:
+            raise Exception("can't export with data")
+        body = self.url_encode(
+            action="export", content=content, **parameters
+        )
+        resp = await self.post(body, content=content, action="export")
+        LOGGER.info(
+            "export resource: status=%i, content=%s",
+            resp.status,
+            content
+        )
+        return resp.read()
+
+    async def import_content(self, content, data, **parameters):
+        """Import content"""
+        body = self.url_encode(
+            action="import", content=content, data=read_data(data),
+            **parameters
+        )
+        if self.compress_requests:
+            resp = await self.post(
+                gzip_compress(body), headers={"content-encoding": "gzip"},
+                content=content, action="import"
+            )
+            if resp.status == HTTPStatus.UNSUPPORTED_MEDIA_TYPE:
+                LOGGER.info("server refused gzip body, sending identity")
+                self.compress_requests = False
+                resp = await self.post(
+                    body, content=content, action="import"
+                )
+        else:
+            resp = await self.post(body, content=content, action="import")
+        LOGGER.info(
+            "import resource: status=%i, content=%s",
+            resp.status,
+            content
+        )
+        return resp.read()
+
+    async def export_partitioned(
+        self, batch_size=1000, workers=None, record_id=None, **parameters
+    ):
+        """Export records in record-ID batches as concurrent requests"""
+        if "records" in parameters:
+            raise Exception("can't partition an explicit record list")
+        fmt = parameters.get("format", self.session_parameters.get("format"))
+        if fmt not in ("json", "csv"):
+            raise Exception("partitioned export needs json or csv")
+        if record_id is None:
+            record_id = json_loads(
+                await self.field_names("export", format="json")
+            )[0]["original_field_name"]
+        batches = batch_record_ids(
+            await self.records(
+                "export", **id_parameters(record_id, parameters)
+            ),
+            record_id,
+            batch_size
+        )
+        LOGGER.info(
+            "partitioned export: batches=%i, workers=%s",
+            len(batches), workers
+        )
+        semaphore = Semaphore(workers or self.limit)
+        async def export_batch(batch):
+            body = self.url_encode(
+                action="export", content="records", records=batch,
+                **parameters
+            )
+            async with semaphore:
+                return checked_body(await self.post(
+                    body, content="records", action="export"
+                ))
+        tasks = [ensure_future(export_batch(b)) for b in batches]
+        try:
+            parts = await gather(*tasks)
+        except BaseException:
+            for task in tasks: # don't leave batches running on failure
+                task.cancel()
+            raise
+        return merge_exports(parts, fmt)
@@ -1,5 +1,9 @@
 """Metadata and associated objects"""
+import ast
+from builtins import compile as compile_code
 from csv import DictReader, DictWriter
+from gzip import compress as gzip_compress, decompress as gzip_decompress
+from hashlib import sha256
 from html.parser import HTMLParser
 from io import IOBase
 from itertools import groupby, zip_longest
@@ -10,12 +14,19 @@ from json import (
     loads as json_loads
 )
 from logging import getLogger
-from re import compile, finditer, sub
+import operator
+from os import environ, makedirs, path as os_path, replace
+from re import compile, finditer, IGNORECASE, sub
+from sys import version_info
+from tempfile import NamedTemporaryFile
+from time import time
 
-from .util import data_type_map
+from .util import codec, data_type_map
 
 
-__all__ = ["Metadata",]
+__all__ = [
+    "BranchingLogic", "DependencyGraph", "Metadata", "MetadataCache",
+]
 
 
 LOGGER = getLogger(__name__)
@@ -280,22 +291,31 @@ def load_field_annotation(value):
     return value
 
 
+METADATUM_DUMPERS = tuple(
+    (column, globals()["dump_{}".format(column)]) for column in COLUMNS
+)
+METADATUM_LOADERS = tuple(
+    (column, globals()["load_{}".format(column)]) for column in COLUMNS
+)
+METADATUM_KEYS = frozenset(COLUMNS)
+
+
 def dump_metadatum(value):
-    """load metadatum"""
-    for column in COLUMNS:
-        func = eval("dump_{}".format(column))
-        value[column] = func(value[column])
-    return value
+    """return dumped copy of metadatum"""
+    return {column: dump(value[column]) for column, dump in METADATUM_DUMPERS}
 
 
 def load_metadatum(value):
-    """load metadatum"""
-    if sorted(value.keys()) != sorted(COLUMNS):
+    """return loaded copy of metadatum"""
+    if value.keys() != METADATUM_KEYS:
         raise Exception("invalid metadatum")
-    for column in COLUMNS:
-        func = eval("load_{}".format(column))
-        value[column] = func(value[column])
-    return value
+    return {column: load(value[column]) for column, load in METADATUM_LOADERS}
+
+
+def load_metadata(raw_metadata):
+    """yield (field name, loaded metadatum) of a metadata export"""
+    for value in raw_metadata:
+        yield value[COLUMNS[0]], load_metadatum(value)
 
 
 TemplateHTML = """
@@ -320,6 +340,448 @@ class TemplateSQL:
     create_schema = "CREATE SCHEMA IF NOT EXISTS {};\n"
     create_table = "CREATE TABLE IF NOT EXISTS {}();\n"
     add_column = "ALTER TABLE {} ADD COLUMN IF NOT EXISTS {} {};\n"
+    sqlite_create_table = (
+        "CREATE TABLE IF NOT EXISTS {} (\n    {},\n    PRIMARY KEY ({})\n);\n"
+    )
+    sqlite_types = {
+        "INT": "INTEGER", "FLOAT": "REAL", "DATE": "TEXT",
+        "DATETIME": "TEXT", "TIME": "TEXT", "TEXT": "TEXT",
+    }
+    sqlite_keys = (
+        "redcap_event_name", "redcap_repeat_instrument",
+        "redcap_repeat_instance",
+    )
+
+
+def sqlite_identifier(name):
+    """return a table or column name double-quoted for SQLite"""
+    return '"{}"'.format(name.replace('"', '""'))
+
+
+def logic_number(value):
+    """return float of a logic operand, or None if not numeric"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class LogicValue(str):
+    """raw field value comparing numerically when both sides are numbers"""
+
+    def compare(self, other, op):
+        """apply op numerically if possible, else as strings"""
+        a, b = logic_number(self), logic_number(other)
+        if a is not None and b is not None:
+            return op(a, b)
+        return op(str(self), str(other))
+
+    def arithmetic(self, other, op):
+        """apply op to numeric operands, blank if either isn't numeric"""
+        a, b = logic_number(self), logic_number(other)
+        if a is None or b is None:
+            return LogicValue("")
+        try:
+            result = op(a, b)
+        except ArithmeticError: # e.g. division by zero, overflow
+            return LogicValue("")
+        if isinstance(result, complex): # e.g. (-8) ^ 0.5
+            return LogicValue("")
+        return result
+
+    __hash__ = str.__hash__
+    __eq__ = lambda self, other: self.compare(other, operator.eq)
+    __ne__ = lambda self, other: self.compare(other, operator.ne)
+    __lt__ = lambda self, other: self.compare(other, operator.lt)
+    __le__ = lambda self, other: self.compare(other, operator.le)
+    __gt__ = lambda self, other: self.compare(other, operator.gt)
+    __ge__ = lambda self, other: self.compare(other, operator.ge)
+    __add__ = lambda self, other: self.arithmetic(other, operator.add)
+    __radd__ = lambda self, other: self.arithmetic(other, operator.add)
+    __sub__ = lambda self, other: self.arithmetic(other, operator.sub)
+    __rsub__ = lambda self, other: LogicValue(other).arithmetic(
+        self, operator.sub
+    )
+    __mul__ = lambda self, other: self.arithmetic(other, operator.mul)
+    __rmul__ = lambda self, other: self.arithmetic(other, operator.mul)
+    __truediv__ = lambda self, other: self.arithmetic(
+        other, operator.truediv
+    )
+    __rtruediv__ = lambda self, other: LogicValue(other).arithmetic(
+        self, operator.truediv
+    )
+    __mod__ = lambda self, other: self.arithmetic(other, operator.mod)
+    __rmod__ = lambda self, other: LogicValue(other).arithmetic(
+        self, operator.mod
+    )
+    __pow__ = lambda self, other: self.arithmetic(other, operator.pow)
+    __rpow__ = lambda self, other: LogicValue(other).arithmetic(
+        self, operator.pow
+    )
+    __neg__ = lambda self: self.arithmetic(0, lambda a, b: -a)
+    __pos__ = lambda self: self.arithmetic(0, lambda a, b: a)
+
+
+class LogicRecord:
+    """read-only `record` mapping exposed to compiled logic"""
+
+    __slots__ = ("record", "metadata")
+
+    def __getitem__(self, field):
+        """return raw field value as a LogicValue"""
+        if isinstance(self.record, dict):
+            return LogicValue(self.record.get(field, ""))
+        value = self.record[field] if field in self.record else None
+        if value is None:
+            return LogicValue("")
+        if field in self.metadata.field_map:
+            value = self.metadata.codec(field)[1](value)
+        return LogicValue(value)
+
+    def __init__(self, record, metadata):
+        """construct view over raw dictionary, Record, or frame row"""
+        self.record = record
+        self.metadata = metadata
+
+
+def logic_if(condition, then, otherwise):
+    """REDCap if()"""
+    return then if condition else otherwise
+
+
+def logic_sum(*values):
+    """REDCap sum(), ignoring blank and non-numeric values"""
+    return sum(
+        n for n in (logic_number(v) for v in values) if n is not None
+    )
+
+
+def logic_format(value):
+    """return raw string stored for a calculated value"""
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    elif isinstance(value, float):
+        if value.is_integer():
+            return str(int(value))
+        return repr(value)
+    return str(value)
+
+
+LOGIC_NAMESPACE = {
+    "__builtins__": {},
+    "abs": abs, "logic_if": logic_if, "max": max, "min": min,
+    "round": round, "sum": logic_sum, "true": True, "false": False,
+}
+LOGIC_NODES = tuple(
+    getattr(ast, name) for name in (
+        "Expression", "BoolOp", "Compare", "BinOp", "UnaryOp", "Constant",
+        "Num", "Str", "NameConstant", # literals before Python 3.8
+        "And", "Or", "Not", "UAdd", "USub", "Eq", "NotEq", "Lt", "LtE",
+        "Gt", "GtE", "Add", "Sub", "Mult", "Div", "Mod", "Pow", "Load",
+    ) if hasattr(ast, name)
+)
+LOGIC_KEYWORD_RE = compile(r"\b(and|or|not)\b", IGNORECASE)
+LOGIC_IF_RE = compile(r"\bif\s*\(", IGNORECASE)
+LOGIC_STRING_RE = compile(r"""('[^']*'|"[^"]*")""")
+
+
+def logic_string_key(node):
+    """return string subscript key of node, None if it isn't one"""
+    if isinstance(node, getattr(ast, "Index", ())): # before Python 3.9
+        node = node.value
+    if isinstance(node, getattr(ast, "Constant", ())):
+        return node.value if isinstance(node.value, str) else None
+    if version_info < (3, 8) and isinstance(node, ast.Str):
+        return node.s # 3.6 and 3.7 have Constant but still parse to Str
+    return None
+
+
+def logic_allowed(node):
+    """return True if a parsed logic expression uses only allowed nodes
+
+    Attributes, dunder names, and names outside LOGIC_NAMESPACE are
+    rejected, so compiled logic can only read `record` and call the
+    namespace functions.
+    """
+    if isinstance(node, ast.Subscript):
+        return (
+            isinstance(node.value, ast.Name) and node.value.id == "record"
+            and logic_string_key(node.slice) is not None
+        )
+    elif isinstance(node, ast.Call):
+        return (
+            isinstance(node.func, ast.Name)
+            and node.func.id in LOGIC_NAMESPACE
+            and not node.func.id.startswith("__")
+            and not node.keywords
+            and all(logic_allowed(arg) for arg in node.args)
+        )
+    elif isinstance(node, ast.Name):
+        return node.id in ("true", "false")
+    elif not isinstance(node, LOGIC_NODES):
+        return False
+    return all(logic_allowed(child) for child in ast.iter_child_nodes(node))
+
+
+def logic_references(expression, field_map):
+    """return original names of the fields a loaded expression reads"""
+    return frozenset(
+        field_map[name]["original_field_name"] if name in field_map
+        else name
+        for name in (
+            m.group(0)[8:-2] for m in DUMP_VARIABLE_RE.finditer(expression)
+        )
+    )
+
+
+class DependencyGraph:
+    """index of the logic and calculations each field feeds"""
+
+    def __init__(self, metadata):
+        """build index from branching logic and calculations"""
+        self.references = {}
+        for field, metadatum in metadata.items():
+            expressions = [metadatum[COLUMNS[11]]]
+            if metadatum[COLUMNS[3]] == "calc":
+                expressions.append(
+                    load_branching_logic(metadatum[COLUMNS[5]])
+                )
+            references = frozenset().union(*(
+                logic_references(e, metadata.field_map) for e in expressions
+            ))
+            if references:
+                self.references[field] = references
+        self.calculated = frozenset(
+            field for field, metadatum in metadata.items()
+            if metadatum[COLUMNS[3]] == "calc"
+        )
+        self.order = self.sort()
+        self.position = {field: i for i, field in enumerate(self.order)}
+        direct = {}
+        for field in self.order:
+            for reference in self.references.get(field, ()):
+                direct.setdefault(reference, []).append(field)
+        self.dependents = {}
+        for field in direct:
+            seen, stack = set(), [field]
+            while stack:
+                for dependent in direct.get(stack.pop(), ()):
+                    if dependent not in seen:
+                        seen.add(dependent)
+                        # only calculations change values downstream
+                        if dependent in self.calculated:
+                            stack.append(dependent)
+            self.dependents[field] = tuple(
+                sorted(seen, key=self.position.get)
+            )
+
+    def affected(self, fields, field_map=None):
+        """return fields to re-check after `fields` change, in order"""
+        if field_map:
+            fields = (
+                field_map[f]["original_field_name"] if f in field_map else f
+                for f in fields
+            )
+        affected = set()
+        for field in fields:
+            affected.update(self.dependents.get(field, ()))
+        return tuple(sorted(affected, key=self.position.get))
+
+    def sort(self):
+        """return fields with logic or calculations, topologically"""
+        nodes = list(self.references)
+        pending = {
+            field: {
+                r for r in self.references[field]
+                if r in self.calculated and r in self.references
+                and r != field
+            }
+            for field in nodes
+        }
+        order = []
+        ready = [field for field in nodes if not pending[field]]
+        feeds = {}
+        for field, refs in pending.items():
+            for reference in refs:
+                feeds.setdefault(reference, []).append(field)
+        while ready:
+            field = ready.pop(0)
+            order.append(field)
+            for dependent in feeds.get(field, ()):
+                pending[dependent].discard(field)
+                if not pending[dependent]:
+                    ready.append(dependent)
+        if len(order) < len(nodes):
+            cyclic = [field for field in nodes if pending[field]]
+            LOGGER.warning("circular calculations: fields=%s", cyclic)
+            order.extend(cyclic)
+        return tuple(order)
+
+
+class BranchingLogic:
+    """branching logic and calculations of every field, compiled once"""
+
+    def __init__(self, metadata):
+        """compile each field's loaded branching logic and calculation"""
+        compiled = {}
+        self.metadata = metadata
+        self.codes = {}
+        self.calculations = {}
+        for field, metadatum in metadata.items():
+            targets = [(self.codes, metadatum[COLUMNS[11]])]
+            if metadatum[COLUMNS[3]] == "calc":
+                targets.append((
+                    self.calculations,
+                    load_branching_logic(metadatum[COLUMNS[5]])
+                ))
+            for codes, expression in targets:
+                if not expression:
+                    continue
+                if expression not in compiled:
+                    compiled[expression] = self.compile(field, expression)
+                if compiled[expression] is not None:
+                    codes[field] = compiled[expression]
+
+    def compile(self, field, expression):
+        """return code object for expression, None if it can't compile"""
+        parts = LOGIC_STRING_RE.split(expression.strip())
+        for i in range(0, len(parts), 2): # skip string literals
+            parts[i] = LOGIC_KEYWORD_RE.sub(
+                lambda m: m.group(0).lower(), parts[i]
+            )
+            parts[i] = LOGIC_IF_RE.sub("logic_if(", parts[i])
+            parts[i] = parts[i].replace("^", "**")
+        try:
+            tree = ast.parse("".join(parts), mode="eval")
+        except SyntaxError:
+            tree = None
+        if tree is None or not logic_allowed(tree):
+            LOGGER.warning(
+                "unsupported logic, field always shown or left blank: "
+                "field=%s, logic=%s", field, expression
+            )
+            return None
+        return compile_code(
+            tree, "<branching_logic:{}>".format(field), "eval"
+        )
+
+    def evaluate(self, record):
+        """return {field: shown} for fields with branching logic"""
+        namespace = dict(
+            LOGIC_NAMESPACE, record=LogicRecord(record, self.metadata)
+        )
+        return {
+            field: self.show(field, code, namespace)
+            for field, code in self.codes.items()
+        }
+
+    def evaluate_batch(self, records):
+        """return list of {field: shown}, one per record or frame row"""
+        return [self.evaluate(record) for record in records]
+
+    def reevaluate(self, record, fields, shown=None):
+        """recalculate and re-check only what depends on changed `fields`
+
+        Affected calculations are written back to `record` as raw
+        strings, in dependency order; `shown` is updated and returned.
+        """
+        shown = {} if shown is None else shown
+        namespace = dict(
+            LOGIC_NAMESPACE, record=LogicRecord(record, self.metadata)
+        )
+        graph = self.metadata.dependencies
+        for field in graph.affected(fields, self.metadata.field_map):
+            if field in self.calculations:
+                try:
+                    value = logic_format(
+                        eval(self.calculations[field], namespace)
+                    )
+                except Exception as exc:
+                    LOGGER.debug(
+                        "calculation failed: field=%s, %r", field, exc
+                    )
+                    value = ""
+                record[field] = value
+            if field in self.codes:
+                shown[field] = self.show(field, self.codes[field], namespace)
+        return shown
+
+    def show(self, field, code, namespace):
+        """return whether field is shown"""
+        try:
+            return bool(eval(code, namespace))
+        except Exception as exc:
+            LOGGER.debug("branching logic failed: field=%s, %r", field, exc)
+            return True # REDCap shows fields with bad logic
+
+
+class MetadataCache:
+    """on-disk metadata snapshots, revalidated after `max_age` seconds"""
+
+    def __init__(self, directory=None, max_age=3600):
+        """construct cache; stale snapshots revalidate by metadata digest"""
+        self.directory = directory or environ.get(
+            "PACDER_CACHE",
+            os_path.join(os_path.expanduser("~"), ".cache", "pacder")
+        )
+        self.max_age = max_age
+
+    def fetch(self, connector, host, path, token, **parameters):
+        """return (raw metadata, field names), from disk when valid"""
+        key = self.key(host, path, token, **parameters)
+        snapshot = self.load(key)
+        raw_metadata = None
+        if snapshot is not None:
+            if time() - snapshot["checked"] < self.max_age:
+                return snapshot["metadata"], snapshot["field_names"]
+            raw_metadata = connector.metadata("export", **parameters)
+            if self.digest(raw_metadata) == snapshot["digest"]:
+                self.store(key, dict(snapshot, checked=time()))
+                return snapshot["metadata"], snapshot["field_names"]
+            LOGGER.info("metadata changed, refreshing snapshot: key=%s", key)
+        if raw_metadata is None:
+            raw_metadata = connector.metadata("export", **parameters)
+        snapshot = {
+            "checked": time(),
+            "digest": self.digest(raw_metadata),
+            "metadata": json_loads(raw_metadata),
+            "field_names": json_loads(connector.field_names("export")),
+        }
+        self.store(key, snapshot)
+        return snapshot["metadata"], snapshot["field_names"]
+
+    def digest(self, body):
+        """return hex digest of response bytes"""
+        return sha256(body).hexdigest()
+
+    def key(self, host, path, token, **parameters):
+        """return cache key (the token is only stored hashed)"""
+        return sha256("\0".join(
+            (host, path, token, json_dumps(parameters, sort_keys=True))
+        ).encode("utf-8")).hexdigest()
+
+    def load(self, key):
+        """return stored snapshot or None"""
+        try:
+            with open(self.path(key), "rb") as fp:
+                return json_loads(gzip_decompress(fp.read()))
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                LOGGER.warning("unreadable metadata snapshot: exc=%s", e)
+            return None
+
+    def path(self, key):
+        """return snapshot file path"""
+        return os_path.join(self.directory, key + ".json.gz")
+
+    def store(self, key, snapshot):
+        """atomically write snapshot"""
+        makedirs(self.directory, exist_ok=True)
+        with NamedTemporaryFile(dir=self.directory, delete=False) as fp:
+            fp.write(gzip_compress(json_dumps(snapshot).encode("utf-8")))
+        replace(fp.name, self.path(key))
 
 
 class Metadata(dict):
@@ -338,31 +800,98 @@ class Metadata(dict):
         )
 
     def __init__(self, raw_metadata=dict(), **kwargs):
-        """construct instance"""
+        """construct instance, optionally limited to `forms`/`fields`"""
         self.project = kwargs.get("project")
+        field_map = kwargs.get("field_names", [])
+        parameters = {
+            k: kwargs[k] for k in ("forms", "fields") if kwargs.get(k)
+        }
         if self.project and not raw_metadata:
             with self.project.connector as conn:
-                raw_metadata = json_loads(conn.metadata("export"))
+                raw_metadata = json_loads(
+                    conn.metadata("export", **parameters)
+                )
                 field_map = json_loads(conn.field_names("export"))
-        super().__init__()
-        for metadatum in raw_metadata:
-            self[metadatum[COLUMNS[0]]] = load_metadatum(metadatum)
+        super().__init__(load_metadata(raw_metadata))
+        self.invalidate()
         self.field_map = {
             field["export_field_name"]: field for field in field_map
+            if dict.__contains__(self, field["original_field_name"])
         }
+        self.compiled_dependencies = DependencyGraph(self) # at load time
+
+    def __delitem__(self, field):
+        """delete metadatum"""
+        super().__delitem__(field)
+        self.invalidate()
 
     def __setitem__(self, field, value):
         """set metadatum"""
         if field not in value:
             value[COLUMNS[0]] = field
         super().__setitem__(field, value)
+        self.invalidate()
+
+    def invalidate(self):
+        """drop everything derived from the metadata
+
+        Called on item assignment and deletion; call it after editing a
+        metadatum in place.
+        """
+        self.serialized = {}
+        self.codec_cache = {}
+        self.compiled_codecs = self.compiled_logic = None
+        self.compiled_dependencies = None
+
+    @property
+    def dependencies(self):
+        """return DependencyGraph, rebuilt after changes"""
+        if self.compiled_dependencies is None:
+            self.compiled_dependencies = DependencyGraph(self)
+        return self.compiled_dependencies
+
+    def codec(self, field):
+        """return (parse, dump) for one export field, compiled once"""
+        try:
+            return self.codec_cache[field]
+        except KeyError:
+            pair = self.codec_cache[field] = codec(self[field][COLUMNS[7]])
+            return pair
+
+    @property
+    def codecs(self):
+        """return (parse, dump) table indexed by field_map position"""
+        if self.compiled_codecs is None:
+            self.compiled_codecs = tuple(
+                self.codec(field) for field in self.field_map
+            )
+        return self.compiled_codecs
+
+    @property
+    def logic(self):
+        """return BranchingLogic compiled on first access"""
+        if self.compiled_logic is None:
+            self.compiled_logic = BranchingLogic(self)
+        return self.compiled_logic
 
     def csv(self):
         """return CSV string"""
-        csv = ", ".join(COLUMNS) + "\n"
-        for row in self.raw():
-            csv += ", ".join(row.values()) + "\n"
-        return csv
+        if "csv" not in self.serialized:
+            csv = ", ".join(COLUMNS) + "\n"
+            for row in self.dumped():
+                csv += ", ".join(row.values()) + "\n"
+            self.serialized["csv"] = csv
+        return self.serialized["csv"]
+
+    def dumped(self, key=COLUMNS[1]):
+        """return cached dumps sorted by `key`, not to be modified"""
+        cache_key = ("raw", key)
+        if cache_key not in self.serialized:
+            self.serialized[cache_key] = sorted(
+                (dump_metadatum(md) for md in self.values()),
+                key=lambda d: d[key]
+            )
+        return self.serialized[cache_key]
 
     def html(self, writable=False):
         """return HTML string"""
@@ -370,32 +899,89 @@ class Metadata(dict):
 
     def json(self):
         """return JSON string"""
-        return json_dumps(self.raw())
+        if "json" not in self.serialized:
+            self.serialized["json"] = json_dumps(self.dumped())
+        return self.serialized["json"]
 
     def raw(self, key=COLUMNS[1]):
         """return non-type-casted list of dictionaries"""
-        return sorted(
-            (dump_metadatum(md) for md in self.values()),
-            key=lambda d: d[key]
-        )
+        return [dict(d) for d in self.dumped(key)]
 
-    def sql(self, schema="", table_groups=COLUMNS[3]):
+    def sql(self, schema="", table_groups=COLUMNS[3], dialect=None):
         """return SQL migration string"""
-        sql = ""
+        cache_key = ("sql", schema, table_groups, dialect)
+        if cache_key in self.serialized:
+            return self.serialized[cache_key]
+        if dialect == "sqlite":
+            sql = self.sqlite(schema, table_groups)
+        elif dialect is not None:
+            raise Exception("unsupported SQL dialect")
+        else:
+            sql = ""
+            if table_groups not in COLUMNS:
+                raise Exception("invalid table grouping")
+            if schema:
+                sql += TemplateSQL.create_schema.format(schema)
+                schema += "."
+            for table, columns in groupby(
+                self.dumped(table_groups), key=lambda d: d[table_groups]
+            ):
+                sql += TemplateSQL.create_table.format(schema + table)
+                for c in columns:
+                    sql += TemplateSQL.add_column.format(
+                        schema + table,
+                        c["field_name"],
+                        data_type_map[c[COLUMNS[7]]][2]
+                    )
+        self.serialized[cache_key] = sql
+        return sql
+
+    def sqlite(self, schema="", table_groups=COLUMNS[1]):
+        """return SQLite schema string, see Metadata.tables"""
         if schema:
-            schema += "."
-            sql += TemplateSQL.create_schema.format(schema)
-        if table_groups not in COLUMNS:
-            raise Exception("invalid table grouping")
-        for table, columns in groupby(
-            sorted(self.raw(), key=lambda d: d[table_groups]),
-            key=lambda d: d[table_groups]
-        ):
-            sql += TemplateSQL.create_table.format(schema + table)
-            for c in columns:
-                sql += TemplateSQL.add_column.format(
-                    schema + table,
-                    c["field_name"],
-                    data_type_map[c[COLUMNS[7]]][2]
+            schema = sqlite_identifier(schema) + "." # an ATTACHed database
+        sql, keys = "", 1 + len(TemplateSQL.sqlite_keys)
+        for table, columns in self.tables(table_groups).items():
+            sql += TemplateSQL.sqlite_create_table.format(
+                schema + sqlite_identifier(table),
+                ",\n    ".join(
+                    "{} {}".format(sqlite_identifier(column), sql_type)
+                    for column, sql_type in columns
+                ),
+                ", ".join(
+                    sqlite_identifier(column) for column, _ in columns[:keys]
                 )
+            )
         return sql
+
+    def tables(self, table_groups=COLUMNS[1]):
+        """return {table: [(export column, SQLite type)]}
+
+        Every table starts with the record id and the event and repeat
+        columns, which together identify a row of a record export.
+        """
+        if table_groups not in COLUMNS:
+            raise Exception("invalid table grouping")
+        record_id = next(iter(self.field_map))
+        groups = {}
+        for field in self.field_map:
+            metadatum = self[field]
+            columns = groups.setdefault(metadatum[table_groups], [])
+            if field == record_id:
+                continue
+            columns.append((
+                field,
+                TemplateSQL.sqlite_types[data_type_map.get(
+                    metadatum[COLUMNS[7]], data_type_map[""]
+                )[2]]
+            ))
+        key_columns = [(record_id, "TEXT NOT NULL")] + [
+            (column, "TEXT NOT NULL DEFAULT ''")
+            for column in TemplateSQL.sqlite_keys
+        ]
+        if table_groups == COLUMNS[1]:
+            for form in groups:
+                groups[form].append((form + "_complete", "INTEGER"))
+        return {
+            table: key_columns + columns for table, columns in groups.items()
+        }
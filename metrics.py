@@ -0,0 +1,184 @@
+"""In-process request metrics in Prometheus text format"""
+from bisect import bisect_left
+from threading import Lock
+
+
+__all__ = ["RequestMetrics",]
+
+
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+    60.0, 120.0,
+)
+SIZE_BUCKETS = tuple(2 ** n for n in range(8, 31, 2)) # 256B to 1GiB
+
+
+def escape_label(value):
+    """return label value escaped for the exposition format"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace(
+        '"', '\\"'
+    )
+
+
+def format_labels(labels):
+    """return {k="v",...} for a tuple of (name, value) pairs"""
+    return "{" + ",".join(
+        '{}="{}"'.format(k, escape_label(v)) for k, v in labels
+    ) + "}"
+
+
+class Histogram:
+    """cumulative histogram series keyed by label tuples"""
+
+    def __init__(self, name, help_text, buckets):
+        """construct empty histogram"""
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.series = {} # labels -> [bucket counts, sum, count]
+
+    def observe(self, labels, value):
+        """add one observation"""
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * len(self.buckets), 0.0, 0]
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[0][index] += 1
+        series[1] += value
+        series[2] += 1
+
+    def render(self):
+        """return exposition lines"""
+        lines = [
+            "# HELP {} {}".format(self.name, self.help_text),
+            "# TYPE {} histogram".format(self.name),
+        ]
+        for labels, (counts, total, count) in sorted(self.series.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append("{}_bucket{} {}".format(
+                    self.name, format_labels(labels + (("le", bound),)),
+                    cumulative
+                ))
+            lines.append("{}_bucket{} {}".format(
+                self.name, format_labels(labels + (("le", "+Inf"),)), count
+            ))
+            lines.append("{}_sum{} {}".format(
+                self.name, format_labels(labels), total
+            ))
+            lines.append("{}_count{} {}".format(
+                self.name, format_labels(labels), count
+            ))
+        return lines
+
+
+class Counter:
+    """monotonic counter series keyed by label tuples"""
+
+    def __init__(self, name, help_text):
+        """construct empty counter"""
+        self.name = name
+        self.help_text = help_text
+        self.series = {}
+
+    def inc(self, labels, value=1):
+        """add `value`"""
+        self.series[labels] = self.series.get(labels, 0) + value
+
+    def render(self):
+        """return exposition lines"""
+        lines = [
+            "# HELP {} {}".format(self.name, self.help_text),
+            "# TYPE {} counter".format(self.name),
+        ]
+        for labels, value in sorted(self.series.items()):
+            lines.append("{}{} {}".format(
+                self.name, format_labels(labels), value
+            ))
+        return lines
+
+
+class RequestMetrics:
+    """connector instrument aggregating request histograms and counters"""
+
+    def __init__(self, prefix="pacder", buckets=LATENCY_BUCKETS):
+        """construct empty metrics"""
+        self.lock = Lock()
+        self.in_flight = 0
+        self.prefix = prefix
+        self.duration = Histogram(
+            prefix + "_request_duration_seconds",
+            "Request wall time until the response body was read.", buckets
+        )
+        self.ttfb = Histogram(
+            prefix + "_request_ttfb_seconds",
+            "Time until response headers were received.", buckets
+        )
+        self.response_size = Histogram(
+            prefix + "_response_size_bytes",
+            "Response body size as received.", SIZE_BUCKETS
+        )
+        self.request_bytes = Counter(
+            prefix + "_request_bytes_total", "Request body bytes sent."
+        )
+        self.response_bytes = Counter(
+            prefix + "_response_bytes_total", "Response body bytes received."
+        )
+        self.retries = Counter(
+            prefix + "_request_retries_total", "Retried attempts."
+        )
+        self.redirects = Counter(
+            prefix + "_request_redirects_total", "Redirects followed."
+        )
+        self.errors = Counter(
+            prefix + "_request_errors_total", "Requests that raised."
+        )
+
+    def prometheus(self):
+        """return metrics in Prometheus text exposition format"""
+        with self.lock:
+            lines = [
+                "# HELP {}_requests_in_flight Requests awaiting "
+                "completion.".format(self.prefix),
+                "# TYPE {}_requests_in_flight gauge".format(self.prefix),
+                "{}_requests_in_flight {}".format(
+                    self.prefix, self.in_flight
+                ),
+            ]
+            for metric in (
+                self.duration, self.ttfb, self.response_size,
+                self.request_bytes, self.response_bytes, self.retries,
+                self.redirects, self.errors,
+            ):
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def request_finished(self, event):
+        """aggregate a finished RequestEvent"""
+        labels = (
+            ("content", event.content or ""), ("action", event.action or ""),
+        )
+        status = labels + ((
+            "status", "error" if event.status is None else str(event.status)
+        ),)
+        with self.lock:
+            self.in_flight -= 1
+            if event.error is not None:
+                self.errors.inc(labels)
+            self.duration.observe(status, event.elapsed)
+            if event.ttfb is not None:
+                self.ttfb.observe(status, event.ttfb)
+            self.response_size.observe(status, event.response_octets)
+            self.request_bytes.inc(labels, event.request_octets)
+            self.response_bytes.inc(labels, event.response_octets)
+            if event.retries:
+                self.retries.inc(labels, event.retries)
+            if event.redirects:
+                self.redirects.inc(labels, event.redirects)
+
+    def request_started(self, event):
+        """count a started RequestEvent"""
+        with self.lock:
+            self.in_flight += 1
@@ -0,0 +1,131 @@
+"""Local SQLite mirror of project records"""
+from logging import getLogger
+import sqlite3
+
+from .metadata import COLUMNS, sqlite_identifier
+from .util import data_type_map
+
+
+__all__ = ["Mirror",]
+
+
+LOGGER = getLogger(__name__)
+
+
+MIRROR_BATCH_SIZE = 5000
+
+
+def sqlite_converter(data_type):
+    """return function casting a raw string to a SQLite value"""
+    parse, dump, sql_type = data_type_map.get(data_type, data_type_map[""])
+    if sql_type == "TEXT":
+        return lambda v: v
+    elif sql_type == "INT":
+        return lambda v: None if v == "" else parse(v)
+    elif sql_type == "FLOAT":
+        return lambda v: None if v == "" else float(parse(v))
+    elif sql_type == "DATETIME":
+        return lambda v: None if v == "" else parse(v).isoformat(" ")
+    return lambda v: None if v == "" else parse(v).isoformat()
+
+
+class Mirror:
+    """SQLite database mirroring record exports, one table per form"""
+
+    def __init__(
+        self, path, metadata, table_groups=COLUMNS[1],
+        batch_size=MIRROR_BATCH_SIZE
+    ):
+        """construct mirror, creating or migrating its tables"""
+        self.connection = sqlite3.connect(path)
+        self.batch_size = batch_size
+        self.by_form = table_groups == COLUMNS[1]
+        self.record_id = next(iter(metadata.field_map))
+        self.tables = metadata.tables(table_groups)
+        self.migrate(metadata.sqlite(table_groups=table_groups))
+        self.statements = {}
+        self.converters = {}
+        for table, columns in self.tables.items():
+            names = [column for column, _ in columns]
+            # whole rows are written, so replacing on the key is an upsert
+            self.statements[table] = (
+                "INSERT OR REPLACE INTO {} ({}) VALUES ({})".format(
+                    sqlite_identifier(table),
+                    ", ".join(sqlite_identifier(name) for name in names),
+                    ", ".join("?" * len(names))
+                )
+            )
+            self.converters[table] = [
+                (column, sqlite_converter(
+                    metadata[column][COLUMNS[7]]
+                    if column in metadata.field_map else ""
+                ))
+                for column in names
+            ]
+
+    def __enter__(self):
+        """enter context"""
+        return self
+
+    def __exit__(self, typ, val, trb):
+        """exit context"""
+        self.close()
+
+    def close(self):
+        """close sqlite connection"""
+        self.connection.close()
+
+    def execute(self, sql, parameters=()):
+        """return cursor of a query against the mirror"""
+        return self.connection.execute(sql, parameters)
+
+    def flush(self, batches):
+        """write pending rows of every table in one transaction"""
+        with self.connection:
+            for table, rows in batches.items():
+                if rows:
+                    self.connection.executemany(self.statements[table], rows)
+                    rows.clear()
+
+    def load(self, raw_records):
+        """upsert raw records in batched transactions, return row count"""
+        batches = {table: [] for table in self.tables}
+        count = pending = 0
+        for raw_record in raw_records:
+            instrument = raw_record.get("redcap_repeat_instrument", "")
+            for table, converters in self.converters.items():
+                if self.by_form and instrument and instrument != table:
+                    continue # repeating rows only carry their instrument
+                batches[table].append(tuple(
+                    convert(str(raw_record.get(column, "")))
+                    for column, convert in converters
+                ))
+            count += 1
+            pending += 1
+            if pending >= self.batch_size:
+                self.flush(batches)
+                pending = 0
+        self.flush(batches)
+        LOGGER.info("mirrored records: rows=%s", count)
+        return count
+
+    def migrate(self, sql):
+        """create missing tables and add columns new to the metadata"""
+        with self.connection:
+            self.connection.executescript(sql)
+            for table, columns in self.tables.items():
+                existing = {
+                    row[1] for row in self.connection.execute(
+                        "PRAGMA table_info({})".format(
+                            sqlite_identifier(table)
+                        )
+                    )
+                }
+                for column, sql_type in columns:
+                    if column not in existing:
+                        self.connection.execute(
+                            "ALTER TABLE {} ADD COLUMN {} {}".format(
+                                sqlite_identifier(table),
+                                sqlite_identifier(column), sql_type
+                            )
+                        )
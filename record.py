@@ -1,54 +1,186 @@
 """Record and related objects"""
+from array import array
 from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal, ROUND_HALF_UP
 from json import (loads as json_loads, dumps as json_dumps)
 from logging import getLogger
+from sys import intern
 
-from .util import data_type_map
+from .metadata import COLUMNS
+from .util import data_type_map, numpy_cast
 
 
-__all__ = ["Record",]
+__all__ = [
+    "diff_records", "numpy_columns", "Record", "RecordDiff", "RecordFrame",
+]
 
 
 LOGGER = getLogger(__name__)
 
 
+SYSTEM_FIELDS = (
+    "redcap_event_name", "redcap_repeat_instrument",
+    "redcap_repeat_instance", "redcap_data_access_group",
+    "redcap_survey_identifier",
+)
+
+
+RecordDiff = namedtuple("RecordDiff", ("added", "removed", "changed"))
+
+
+def snapshot_number(value):
+    """return canonical string of a Decimal, e.g. 1.5 for 1.50"""
+    value = value.normalize()
+    if value.as_tuple().exponent > 0:
+        value = value.quantize(1) # 100, not 1E+2
+    return str(value)
+
+
+def snapshot_rows(records, metadata=None):
+    """yield codec-normalized raw dictionaries of records or frame rows
+
+    Numbers are written without trailing zeros, as frames dump them at
+    the column's scale and REDCap exports them as entered.
+    """
+    for record in records:
+        if isinstance(record, RecordFrame):
+            yield from snapshot_rows(record, metadata)
+        elif not isinstance(record, dict):
+            raw_record = record.raw() # Record, LazyRecord or RowView
+            for field, value in raw_record.items():
+                if value != "":
+                    value = record[field]
+                    if isinstance(value, Decimal):
+                        raw_record[field] = snapshot_number(value)
+            yield raw_record
+        elif metadata is None:
+            yield record
+        else:
+            raw_record = {}
+            for field, value in record.items():
+                if field in metadata.field_map and value != "":
+                    parse, dump = metadata.codec(field)
+                    value = parse(value)
+                    value = (
+                        snapshot_number(value) if isinstance(value, Decimal)
+                        else dump(value)
+                    )
+                raw_record[field] = value
+            yield raw_record
+
+
+def snapshot_key(raw_record, record_id):
+    """return (record id, event, instrument, instance) of a row"""
+    return (raw_record[record_id],) + tuple(
+        str(raw_record.get(field, "")) for field in SYSTEM_FIELDS[:3]
+    )
+
+
+def snapshot_digest(raw_record):
+    """return hash of a row's non-blank values"""
+    return hash(frozenset(
+        item for item in raw_record.items() if item[1] != ""
+    ))
+
+
+def diff_records(old, new, record_id, metadata=None):
+    """return RecordDiff of two snapshots of Records, frames or dicts
+
+    Rows are keyed by record id, event and repeat instrument/instance;
+    `changed` maps keys to {field: (old value, new value)}. Plain dicts
+    are normalized through `metadata` codecs when it is given.
+    """
+    previous = {}
+    for raw_record in snapshot_rows(old, metadata):
+        previous[snapshot_key(raw_record, record_id)] = (
+            snapshot_digest(raw_record), raw_record
+        )
+    added, changed = [], {}
+    for raw_record in snapshot_rows(new, metadata):
+        key = snapshot_key(raw_record, record_id)
+        try:
+            digest, old_record = previous.pop(key)
+        except KeyError:
+            added.append(key)
+            continue
+        if digest == snapshot_digest(raw_record):
+            continue # unchanged, barring a hash collision
+        fields = {}
+        for field in dict.fromkeys(list(old_record) + list(raw_record)):
+            before = old_record.get(field, "")
+            after = raw_record.get(field, "")
+            if before != after:
+                fields[field] = (before, after)
+        if fields:
+            changed[key] = fields
+    return RecordDiff(added, list(previous), changed)
+
+
+def numpy_columns(raw_records, metadata, scaled=False):
+    """return dictionary of masked numpy arrays, one per field"""
+    raw_columns = {field: [] for field in metadata.field_map}
+    for raw_record in raw_records:
+        for field, values in raw_columns.items():
+            values.append(raw_record.get(field, ""))
+    return {
+        field: numpy_cast(
+            raw_columns.pop(field), metadata[field][COLUMNS[7]], scaled
+        )
+        for field in list(raw_columns)
+    }
+
+
 class Field:
     """field descriptor"""
 
     def __delete__(self, obj):
         """validate delete and delete field value"""
-        setattr(obj, "_" + self.name, None)
+        self.__set__(obj, None)
 
     def __get__(self, obj, obj_owner=None):
         """validate and return field value"""
-        return getattr(obj, "_" + self.name, None)
+        if obj is None:
+            return self
+        return getattr(obj, self.slot, None)
+
+    def __init__(self, parse, dump):
+        """construct descriptor around a compiled field codec"""
+        self.parse = parse
+        self.dump = dump
 
     def __set__(self, obj, value):
-        """cast and set field value"""
-        value = data_type_map[
-            obj.project.metadata[self.name][
-                obj.project.metadata.columns[7]
-            ]
-        ][0](value)
-        setattr(obj, "_" + self.name, value)
+        """cast and set field value, marking it dirty"""
+        setattr(obj, self.slot, self.parse(value))
+        dirty = getattr(obj, "_Record__dirty", None) # None while hydrating
+        if dirty is not None:
+            dirty.add(self.name)
 
     def __set_name__(self, obj_owner, name):
         """remember what field this descriptor manages"""
         self.name = name
+        self.slot = "_" + name
 
 
 class Record:
     """REDCap record container"""
-    
+
+    __slots__ = ("__dirty",) # names of fields set since export
+    project = None
+    fields = () # export field names, each managed by a Field
+    extra_fields = () # e.g. redcap_event_name, kept as raw strings
+    field_set = frozenset()
+    dumps = () # (field, slot, dump) in field order
+
     def __contains__(self, field):
         """implement membership test operator"""
-        if field in self.project.metadata:
+        if field in self.field_set:
             return True
         return False
 
     def __delitem__(self, field):
         """delete field value"""
-        if field not in self.project.metadata:
+        if field not in self.field_set:
             raise Exception("no such field")
         setattr(self, field, None)
     
@@ -56,46 +188,36 @@ class Record:
         """implement equality test operator"""
         if type(self) != type(other):
             return NotImplemented
-        if all(
-            self.get(field) == other.get(field)
-            for field in self.project.metadata
-        ):
+        if self.raw() == other.raw():
             return True
         return False
 
     def __getitem__(self, field):
         """return field"""
-        if field not in self.project.metadata:
+        if field not in self.field_set:
             raise Exception("no such field")
-        return getattr(self, field)
+        return getattr(self, field, None)
 
     def __init__(self, raw_record=None):
-        """construct instance"""
+        """construct instance, clean when hydrated from `raw_record`"""
+        self.__dirty = None
         if raw_record is not None:
             for k,v in raw_record.items():
-                if k in self.project.metadata:
+                if k in self.field_set:
                     setattr(self, k, v)
                 else:
                     raise Exception(
                         "raw record doesn't match metadata"
                     )
+        self.__dirty = set()
 
     def __iter__(self):
         """return iterator of self"""
-        return (self[field] for field in self.project.metadata)
+        return (self[field] for field in self.fields)
 
     def __len__(self):
         """return number of fields"""
-        return len(self.project.metadata)
-
-    # def __new__(cls, **kwargs):
-    #     """initialize and name field descriptors"""
-    #     project = kwargs.pop("project")
-    #     obj = super().__new__(cls)
-    #     obj.project = project
-    #     for field in obj.project.metadata:
-    #         setattr(obj, field, Field())
-    #     return obj
+        return len(self.fields)
 
     def __next__(self):
         """return next item"""
@@ -103,16 +225,361 @@ class Record:
 
     def __setitem__(self, field, value):
         """set record field value"""
-        if field not in self.project.metadata:
+        if field not in self.field_set:
             raise Exception("no such field")
         setattr(self, field, value)
 
     def __str__(self):
         """return JSON string of self"""
-        return json_dumps(
-            {
-                data_type_map[self.project.metadata[field][
-                    self.project.metadata.columns[7]
-                ]][1](self[field])
-            } for field in self.project.metadata
+        return json_dumps(self.raw())
+
+    @property
+    def dirty(self):
+        """return names of fields set since export"""
+        return frozenset(self.__dirty or ())
+
+    def changes(self):
+        """return raw dictionary of record keys and dirty fields only"""
+        cls, dirty = type(self), self.__dirty or ()
+        raw = {}
+        for field in self.fields:
+            if field in dirty or field == self.fields[0]:
+                raw[field] = cls.materialize(field).dump(
+                    getattr(self, "_" + field, None)
+                )
+        for field in SYSTEM_FIELDS[:3]: # event and repeat keys
+            value = getattr(self, field, None)
+            if value is not None and field in self.field_set:
+                raw[field] = value
+        return raw
+
+    def clean(self, fields=None):
+        """forget dirty `fields` (default all), e.g. after an import"""
+        if fields is None:
+            self.__dirty = set()
+        elif self.__dirty:
+            self.__dirty.difference_update(fields)
+
+    @classmethod
+    def for_project(cls, project, lazy=False):
+        """return Record subclass with slots for project's fields"""
+        metadata = project.metadata
+        fields = tuple(metadata.field_map)
+        extra_fields = tuple(
+            field for field in SYSTEM_FIELDS + tuple(
+                form + "_complete" for form in dict.fromkeys(
+                    md[COLUMNS[1]] for md in metadata.values()
+                )
+            )
+            if field not in metadata.field_map
+        )
+        reserved = set(dir(LazyRecord))
+        clashes = [
+            f for f in fields if f in reserved or "_" + f in reserved
+        ]
+        if clashes:
+            raise Exception(
+                "field names clash with Record attributes: {}".format(
+                    ", ".join(clashes)
+                )
+            )
+        namespace = {
+            "__slots__": tuple("_" + f for f in fields) + extra_fields,
+            "project": project,
+            "fields": fields,
+            "extra_fields": extra_fields,
+            "field_set": frozenset(fields + extra_fields),
+        }
+        if lazy:
+            # descriptors and codecs are built by LazyRecord on access
+            return type(cls.__name__, (LazyRecord,), namespace)
+        for field, (parse, dump) in zip(fields, metadata.codecs):
+            namespace[field] = Field(parse, dump)
+        namespace["dumps"] = tuple(
+            (field, "_" + field, dump)
+            for field, (parse, dump) in zip(fields, metadata.codecs)
         )
+        return type(cls.__name__, (cls,), namespace)
+
+    @classmethod
+    def materialize(cls, field):
+        """return field's descriptor"""
+        return cls.__dict__[field]
+
+    def raw(self):
+        """return non-type-casted dictionary of self"""
+        raw = {
+            field: dump(getattr(self, slot, None))
+            for field, slot, dump in self.dumps
+        }
+        for field in self.extra_fields:
+            value = getattr(self, field, None)
+            if value is not None:
+                raw[field] = value
+        return raw
+
+
+class LazyRecord(Record):
+    """Record materializing field descriptors on first access"""
+
+    __slots__ = ()
+
+    def __getattr__(self, name):
+        """materialize field descriptor, then return field value"""
+        cls = type(self)
+        if name in cls.fields:
+            return cls.materialize(name).__get__(self, cls)
+        raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        """materialize field descriptor, then set field value"""
+        cls = type(self)
+        if name not in cls.__dict__ and name in cls.fields:
+            cls.materialize(name)
+        object.__setattr__(self, name, value)
+
+    @classmethod
+    def materialize(cls, field):
+        """return field's descriptor, installing it if missing"""
+        descriptor = cls.__dict__.get(field)
+        if descriptor is None:
+            descriptor = Field(*cls.project.metadata.codec(field))
+            descriptor.__set_name__(cls, field)
+            setattr(cls, field, descriptor)
+        return descriptor
+
+    def raw(self):
+        """return non-type-casted dictionary of self"""
+        cls, raw = type(self), {}
+        for field in self.fields:
+            value = getattr(self, "_" + field, None)
+            raw[field] = (
+                "" if value is None else cls.materialize(field).dump(value)
+            )
+        for field in self.extra_fields:
+            value = getattr(self, field, None)
+            if value is not None:
+                raw[field] = value
+        return raw
+
+
+class Column:
+    """typed storage for one field of a RecordFrame"""
+
+    __slots__ = ("name", "data_type", "kind", "values", "mask", "scale")
+
+    def __getitem__(self, index):
+        """return python value at index, or None when blank"""
+        if self.kind == "TEXT":
+            return self.values[index]
+        if not self.mask[index]:
+            return None
+        value = self.values[index]
+        if self.kind == "INT":
+            return value
+        elif self.kind == "FLOAT":
+            return Decimal(value).scaleb(-self.scale)
+        elif self.kind == "DATE":
+            return date.fromordinal(value)
+        elif self.kind == "DATETIME":
+            days, seconds = divmod(value, 86400)
+            return datetime.fromordinal(days) + timedelta(seconds=seconds)
+        return time(value // 3600, value // 60 % 60, value % 60)
+
+    def __init__(self, name, data_type, raw_values=()):
+        """construct column, casting raw strings in one pass"""
+        self.name = name
+        self.data_type = data_type
+        self.kind = data_type_map[data_type][2]
+        self.scale = 0
+        raw_values = list(raw_values)
+        if self.kind == "TEXT":
+            self.values = [intern(v) for v in raw_values]
+            self.mask = None
+            return
+        self.mask = bytearray(v != "" for v in raw_values)
+        values = iter(self.cast([v for v in raw_values if v != ""]))
+        # blanks hold a zero placeholder
+        self.values = array("q", (
+            self.encode(next(values)) if m else 0 for m in self.mask
+        ))
+
+    def __len__(self):
+        """return number of values"""
+        return len(self.values)
+
+    def cast(self, raw_values):
+        """return iterable of python values for non-blank raw strings"""
+        parse = data_type_map[self.data_type][0]
+        if self.kind != "FLOAT":
+            return map(parse, raw_values)
+        values = [parse(v) for v in raw_values]
+        digits = self.data_type.partition("dp")[0].rpartition("_")[2]
+        if digits.isdigit():
+            self.scale = int(digits)
+        else:
+            self.scale = max(
+                [-v.as_tuple().exponent for v in values] + [0]
+            )
+        return values
+
+    def encode(self, value):
+        """return int stored for a python value"""
+        if self.kind == "INT":
+            return value
+        elif self.kind == "FLOAT":
+            return int(value.scaleb(self.scale).to_integral_value(
+                rounding=ROUND_HALF_UP
+            ))
+        elif self.kind == "DATE":
+            return value.toordinal()
+        elif self.kind == "DATETIME":
+            return (
+                value.toordinal() * 86400
+                + value.hour * 3600 + value.minute * 60 + value.second
+            )
+        return value.hour * 3600 + value.minute * 60 + value.second
+
+    def raw(self, index):
+        """return non-type-casted string at index"""
+        value = self[index]
+        if value is None:
+            return ""
+        return data_type_map[self.data_type][1](value)
+
+    def set(self, index, raw_value):
+        """cast raw string and store it at index"""
+        if self.kind == "TEXT":
+            self.values[index] = intern(raw_value)
+        elif raw_value == "":
+            self.mask[index], self.values[index] = 0, 0
+        else:
+            self.mask[index] = 1
+            self.values[index] = self.encode(
+                data_type_map[self.data_type][0](raw_value)
+            )
+
+    def slice(self, key):
+        """return new column holding values[key]"""
+        column = Column.__new__(Column)
+        column.name, column.data_type = self.name, self.data_type
+        column.kind, column.scale = self.kind, self.scale
+        column.values = self.values[key]
+        column.mask = None if self.mask is None else self.mask[key]
+        return column
+
+
+class RowView:
+    """Record-like view of one RecordFrame row"""
+
+    __slots__ = ("frame", "index")
+
+    def __contains__(self, field):
+        """implement membership test operator"""
+        return field in self.frame.columns
+
+    def __getattr__(self, field):
+        """return field value"""
+        try:
+            return self.frame.columns[field][self.index]
+        except KeyError:
+            raise AttributeError(field)
+
+    def __getitem__(self, field):
+        """return field"""
+        if field not in self.frame.columns:
+            raise Exception("no such field")
+        return self.frame.columns[field][self.index]
+
+    def __init__(self, frame, index):
+        """construct view"""
+        self.frame = frame
+        self.index = index
+
+    def __iter__(self):
+        """return iterator of field values"""
+        return (c[self.index] for c in self.frame.columns.values())
+
+    def __len__(self):
+        """return number of fields"""
+        return len(self.frame.columns)
+
+    def __setitem__(self, field, value):
+        """set field from raw string"""
+        if field not in self.frame.columns:
+            raise Exception("no such field")
+        self.frame.columns[field].set(self.index, value)
+
+    def __str__(self):
+        """return JSON string of self"""
+        return json_dumps(self.raw())
+
+    def raw(self):
+        """return non-type-casted dictionary of self"""
+        return {
+            field: column.raw(self.index)
+            for field, column in self.frame.columns.items()
+        }
+
+
+class RecordFrame:
+    """columnar container for exported records"""
+
+    def __getitem__(self, key):
+        """return row view, column values, or sliced frame"""
+        if isinstance(key, str):
+            return self.column(key)
+        elif isinstance(key, slice):
+            frame = RecordFrame.__new__(RecordFrame)
+            frame.columns = {
+                field: column.slice(key)
+                for field, column in self.columns.items()
+            }
+            frame.length = len(range(*key.indices(self.length)))
+            return frame
+        if key < 0:
+            key += self.length
+        if not 0 <= key < self.length:
+            raise IndexError("row index out of range")
+        return RowView(self, key)
+
+    def __init__(self, raw_records, metadata):
+        """construct frame, casting each column once"""
+        raw_columns = {field: [] for field in metadata.field_map}
+        self.length = 0
+        for raw_record in raw_records:
+            for field, value in raw_record.items():
+                if field not in raw_columns:
+                    # e.g. redcap_event_name, kept as text
+                    raw_columns[field] = [""] * self.length
+                raw_columns[field].append(value)
+            self.length += 1
+            for values in raw_columns.values():
+                if len(values) < self.length:
+                    values.append("")
+        self.columns = {}
+        for field, values in raw_columns.items():
+            data_type = ""
+            if field in metadata:
+                data_type = metadata[field][COLUMNS[7]]
+            if data_type not in data_type_map:
+                data_type = "" # e.g. slider number
+            self.columns[field] = Column(field, data_type, values)
+            values.clear()
+
+    def __iter__(self):
+        """return iterator of row views"""
+        return (RowView(self, i) for i in range(self.length))
+
+    def __len__(self):
+        """return number of rows"""
+        return self.length
+
+    def column(self, field):
+        """return list of python values for field"""
+        column = self.columns[field]
+        return [column[i] for i in range(self.length)]
+
+    def raw(self):
+        """return non-type-casted list of dictionaries"""
+        return [row.raw() for row in self]
@@ -0,0 +1,180 @@
+"""Incremental record sync against a local checkpoint store"""
+from contextlib import closing
+from datetime import datetime, timedelta
+from hashlib import sha256
+from json import (loads as json_loads, dumps as json_dumps)
+from logging import getLogger
+import sqlite3
+
+from .util import CHUNK_SIZE, iter_json_array
+
+
+__all__ = ["SyncStore",]
+
+
+LOGGER = getLogger(__name__)
+
+
+REDCAP_TIMESTAMP = "%Y-%m-%d %H:%M:%S"
+SYNC_BATCH_SIZE = 1000
+SYNC_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoint (
+    project TEXT PRIMARY KEY,
+    synced_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS record (
+    project TEXT NOT NULL,
+    record_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    instrument TEXT NOT NULL,
+    instance TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (project, record_id, event, instrument, instance)
+);
+"""
+
+
+def sync_key(host, path, token):
+    """return store key of a project (the token is only stored hashed)"""
+    return sha256(
+        "\0".join((host, path, token)).encode("utf-8")
+    ).hexdigest()
+
+
+def row_key(raw_record, record_id):
+    """return (record id, event, instrument, instance) of an export row"""
+    return (
+        raw_record[record_id],
+        raw_record.get("redcap_event_name", ""),
+        raw_record.get("redcap_repeat_instrument", ""),
+        str(raw_record.get("redcap_repeat_instance", "")),
+    )
+
+
+class SyncStore:
+    """sqlite file holding per-project checkpoints and record rows"""
+
+    def __init__(self, path=":memory:", overlap=300, timezone=None):
+        """construct store; `overlap` seconds are re-exported each sync
+
+        REDCap reads date ranges in the server's local time, so pass the
+        server's `timezone` (a tzinfo, e.g. datetime.timezone of its UTC
+        offset) when it differs from this machine's.
+        """
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SYNC_SCHEMA)
+        self.overlap = timedelta(seconds=overlap)
+        self.timezone = timezone
+
+    def __enter__(self):
+        """enter context"""
+        return self
+
+    def __exit__(self, typ, val, trb):
+        """exit context"""
+        self.close()
+
+    def checkpoint(self, key):
+        """return last sync time of project, None if never synced"""
+        row = self.connection.execute(
+            "SELECT synced_at FROM checkpoint WHERE project = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        return datetime.strptime(row[0], REDCAP_TIMESTAMP)
+
+    def close(self):
+        """close sqlite connection"""
+        self.connection.close()
+
+    def merge(self, key, record_id, raw_records):
+        """replace local rows of every record present in `raw_records`"""
+        replaced, batch = set(), []
+        for raw_record in raw_records:
+            row = row_key(raw_record, record_id)
+            if row[0] not in replaced:
+                # a changed record is exported whole, drop its old rows
+                self.flush(batch)
+                self.connection.execute(
+                    "DELETE FROM record WHERE project = ? AND record_id = ?",
+                    (key, row[0])
+                )
+                replaced.add(row[0])
+            batch.append((key,) + row + (json_dumps(raw_record),))
+            if len(batch) >= SYNC_BATCH_SIZE:
+                self.flush(batch)
+        self.flush(batch)
+        return replaced
+
+    def flush(self, batch):
+        """write pending rows"""
+        if batch:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO record VALUES (?, ?, ?, ?, ?, ?)",
+                batch
+            )
+            batch.clear()
+
+    def prune(self, key, record_ids):
+        """delete local records missing from `record_ids`, return them"""
+        local = {
+            row[0] for row in self.connection.execute(
+                "SELECT DISTINCT record_id FROM record WHERE project = ?",
+                (key,)
+            )
+        }
+        deleted = local - set(record_ids)
+        self.connection.executemany(
+            "DELETE FROM record WHERE project = ? AND record_id = ?",
+            ((key, record) for record in deleted)
+        )
+        return deleted
+
+    def records(self, key):
+        """return local copy of project records"""
+        return [
+            json_loads(row[0]) for row in self.connection.execute(
+                "SELECT data FROM record WHERE project = ? ORDER BY rowid",
+                (key,)
+            )
+        ]
+
+    def sync(self, connector, key, record_id, chunk_size=CHUNK_SIZE):
+        """export records changed since last checkpoint and merge them
+
+        Returns a dictionary with the record ids that were "changed" and
+        "deleted". Checkpoints are taken in the store's `timezone`, by
+        default the local clock, which is then assumed to match the
+        REDCap server's, give or take `overlap`.
+        """
+        began = datetime.now(self.timezone).replace(
+            tzinfo=None, microsecond=0
+        )
+        checkpoint = self.checkpoint(key)
+        parameters = {"dateRangeEnd": began.strftime(REDCAP_TIMESTAMP)}
+        if checkpoint is not None:
+            parameters["dateRangeBegin"] = (
+                checkpoint - self.overlap
+            ).strftime(REDCAP_TIMESTAMP)
+        with self.connection:
+            with connector.connection() as conn:
+                with closing(conn.records("stream", **parameters)) as resp:
+                    changed = self.merge(
+                        key, record_id, iter_json_array(resp, chunk_size)
+                    )
+                # deletes leave no trace in a date range, diff the ids
+                record_ids = {
+                    r[record_id] for r in json_loads(
+                        conn.records("export", fields=[record_id])
+                    )
+                }
+            deleted = self.prune(key, record_ids)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO checkpoint VALUES (?, ?)",
+                (key, began.strftime(REDCAP_TIMESTAMP))
+            )
+        LOGGER.info(
+            "synced records: changed=%s, deleted=%s",
+            len(changed), len(deleted)
+        )
+        return {"changed": changed, "deleted": deleted}
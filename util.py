@@ -1,11 +1,121 @@
 """Helpers for core modules"""
+from codecs import getincrementaldecoder
 from collections import namedtuple
+from csv import reader as csv_reader
 from datetime import date, datetime, time
 from decimal import Context, Decimal, ROUND_HALF_UP
-from re import sub
+from functools import lru_cache
+from io import BufferedReader, TextIOWrapper
+from json import JSONDecoder
+from re import compile, sub
 
+try:
+    import numpy
+except ImportError: # optional, only needed by numpy_cast
+    numpy = None
 
-__all__ = ["data_type_map",]
+
+__all__ = [
+    "codec", "data_type_map", "iter_json_array", "numpy_cast",
+]
+
+
+CHUNK_SIZE = 64 * 1024
+JSON_SEPARATOR_RE = compile(r"[\s,]*")
+
+
+# character positions moving dmy/mdy layouts into ISO 8601 order
+ISO_ORDER = {
+    "dmy": [6, 7, 8, 9, 2, 3, 4, 5, 0, 1],
+    "mdy": [6, 7, 8, 9, 2, 0, 1, 5, 3, 4],
+    "ymd": list(range(10)),
+}
+
+
+DATE_FORMATS = {"dmy": "%d-%m-%Y", "mdy": "%m-%d-%Y", "ymd": "%Y-%m-%d"}
+DATE_SLICES = { # (year, month, day) positions, separator positions
+    "dmy": ((6, 10), (3, 5), (0, 2), (2, 5)),
+    "mdy": ((6, 10), (0, 2), (3, 5), (2, 5)),
+    "ymd": ((0, 4), (5, 7), (8, 10), (4, 7)),
+}
+PARSE_CACHE_SIZE = 4096
+
+
+def is_digits(value, slices):
+    """return True if every (start, stop) slice of value is all digits"""
+    for start, stop in slices:
+        if not value[start:stop].isdigit():
+            return False
+    return True
+
+
+def date_parser(order):
+    """return memoized parser for a fixed-layout REDCap date"""
+    (ya, yb), (ma, mb), (da, db), (sa, sb) = DATE_SLICES[order]
+    fmt = DATE_FORMATS[order]
+    slices = DATE_SLICES[order][:3]
+    @lru_cache(maxsize=PARSE_CACHE_SIZE)
+    def parse(value):
+        if (
+            len(value) == 10 and value[sa] == value[sb] == "-"
+            and is_digits(value, slices)
+        ):
+            try:
+                return date(
+                    int(value[ya:yb]), int(value[ma:mb]), int(value[da:db])
+                )
+            except ValueError:
+                pass
+        return datetime.strptime(value, fmt).date() # raises if invalid
+    return parse
+
+
+def datetime_parser(order, seconds=False):
+    """return memoized parser for a fixed-layout REDCap datetime"""
+    (ya, yb), (ma, mb), (da, db), (sa, sb) = DATE_SLICES[order]
+    fmt = DATE_FORMATS[order] + (" %H:%M:%S" if seconds else " %H:%M")
+    length = 19 if seconds else 16
+    slices = DATE_SLICES[order][:3] + ((11, 13), (14, 16)) + (
+        ((17, 19),) if seconds else ()
+    )
+    @lru_cache(maxsize=PARSE_CACHE_SIZE)
+    def parse(value):
+        if (
+            len(value) == length
+            and value[sa] == value[sb] == "-"
+            and value[10] == " " and value[13] == ":"
+            and (not seconds or value[16] == ":")
+            and is_digits(value, slices)
+        ):
+            try:
+                return datetime(
+                    int(value[ya:yb]), int(value[ma:mb]),
+                    int(value[da:db]), int(value[11:13]),
+                    int(value[14:16]), int(value[17:19]) if seconds else 0
+                )
+            except ValueError:
+                pass
+        return datetime.strptime(value, fmt)
+    return parse
+
+
+def time_parser(fmt):
+    """return memoized parser for REDCap HH:MM or MM:SS times"""
+    minutes_seconds = fmt == "%M:%S"
+    @lru_cache(maxsize=PARSE_CACHE_SIZE)
+    def parse(value):
+        if (
+            len(value) == 5 and value[2] == ":"
+            and is_digits(value, ((0, 2), (3, 5)))
+        ):
+            try:
+                if minutes_seconds:
+                    return time(0, int(value[:2]), int(value[3:]))
+                return time(int(value[:2]), int(value[3:]))
+            except ValueError:
+                pass
+        return datetime.strptime(value, fmt).time()
+    return parse
 
 
 DCM = { # decimal context map
@@ -24,48 +134,48 @@ DCM = { # decimal context map
 
 data_type_map = {
     "date_dmy": (
-        lambda d: date.strptime(d, "%d-%m-%Y"),
-        lambda d: d.strftime("%d-%m-%Y"),
+        date_parser("dmy"),
+        lambda d: d.strftime(DATE_FORMATS["dmy"]),
         "DATE",
     ),
     "date_mdy": (
-        lambda d: date.strptime(d, "%m-%d-%Y"),
-        lambda d: d.strftime("%m-%d-%Y"),
+        date_parser("mdy"),
+        lambda d: d.strftime(DATE_FORMATS["mdy"]),
         "DATE",
     ),
     "date_ymd": (
-        lambda d: date.strptime(d, "%Y-%m-%d"),
-        lambda d: d.strftime("%Y-%m-%d"),
+        date_parser("ymd"),
+        lambda d: d.strftime(DATE_FORMATS["ymd"]),
         "DATE",
     ),
     "datetime_dmy": (
-        lambda d: datetime.strptime(d, "%d-%m-%Y %H:%M"),
-        lambda d: d.strftime("%d-%m-%Y %H:%M"),
+        datetime_parser("dmy"),
+        lambda d: d.strftime(DATE_FORMATS["dmy"] + " %H:%M"),
         "DATETIME",
     ),
     "datetime_mdy": (
-        lambda d: datetime.strptime(d, "%m-%d-%Y %H:%M"),
-        lambda d: d.strftime("%m-%d-%Y %H:%M"),
+        datetime_parser("mdy"),
+        lambda d: d.strftime(DATE_FORMATS["mdy"] + " %H:%M"),
         "DATETIME",
     ),
     "datetime_ymd": (
-        lambda d: datetime.strptime(d, "%Y-%m-%d %H:%M"),
-        lambda d: d.strftime("%Y-%m-%d %H:%M"),
+        datetime_parser("ymd"),
+        lambda d: d.strftime(DATE_FORMATS["ymd"] + " %H:%M"),
         "DATETIME",
     ),
     "datetime_seconds_dmy": (
-        lambda d: datetime.strptime(d, "%Y-%m-%d %H:%M:%S"),
-        lambda d: d.strftime("%Y-%m-%d %H:%M:%S"),
+        datetime_parser("dmy", seconds=True),
+        lambda d: d.strftime(DATE_FORMATS["dmy"] + " %H:%M:%S"),
         "DATETIME",
     ),
     "datetime_seconds_mdy": (
-        lambda d: datetime.strptime(d, "%m-%d-%Y %H:%M:%S"),
-        lambda d: d.strftime("%m-%d-%Y %H:%M:%S"),
+        datetime_parser("mdy", seconds=True),
+        lambda d: d.strftime(DATE_FORMATS["mdy"] + " %H:%M:%S"),
         "DATETIME",
     ),
     "datetime_seconds_ymd": (
-        lambda d: datetime.strptime(d, "%Y-%m-%d %H:%M:%S"),
-        lambda d: d.strftime("%Y-%m-%d %H:%M:%S"),
+        datetime_parser("ymd", seconds=True),
+        lambda d: d.strftime(DATE_FORMATS["ymd"] + " %H:%M:%S"),
         "DATETIME",
     ),
     "email": (lambda s: s, lambda s: s, "TEXT",),
@@ -137,12 +247,12 @@ data_type_map = {
     "postalcode_canada": (lambda s: s, lambda s: s, "TEXT",),
     "ssn": (lambda s: s, lambda s: s, "TEXT",),
     "time": (
-        lambda t: time.strptime(t, "%H:%M"),
+        time_parser("%H:%M"),
         lambda t: t.strftime("%H:%M"),
         "TIME",
     ),
     "time_mm_ss": (
-        lambda t: time.strptime(t, "%M:%S"),
+        time_parser("%M:%S"),
         lambda t: t.strftime("%M:%S"),
         "TIME",
     ),
@@ -150,3 +260,134 @@ data_type_map = {
     "Zipcode": (lambda s: s, lambda s: s, "TEXT",),
     "": (lambda s: s, lambda s: s, "TEXT",),
 }
+
+
+def iter_json_array(fp, chunk_size=CHUNK_SIZE, encoding="utf-8"):
+    """yield items of a JSON array read incrementally from `fp`"""
+    decoder = JSONDecoder()
+    text_decoder = getincrementaldecoder(encoding)()
+    buffer, pos, started, eof = "", 0, False, False
+    while True:
+        if not eof:
+            chunk = fp.read(chunk_size)
+            eof = not chunk
+            buffer = buffer[pos:] + text_decoder.decode(chunk, final=eof)
+            pos = 0
+        if not started:
+            pos = JSON_SEPARATOR_RE.match(buffer, pos).end()
+            if pos == len(buffer):
+                if eof:
+                    return
+                continue
+            if buffer[pos] != "[":
+                raise Exception("response is not a JSON array")
+            pos, started = pos + 1, True
+        while True:
+            pos = JSON_SEPARATOR_RE.match(buffer, pos).end()
+            if pos == len(buffer):
+                break
+            if buffer[pos] == "]":
+                return
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+            except ValueError:
+                if eof:
+                    raise Exception("truncated JSON array")
+                break
+            if end == len(buffer) and not eof:
+                break # item may continue in the next chunk
+            yield item
+            pos = end
+        if eof:
+            raise Exception("truncated JSON array")
+
+
+CSV_DELIMITERS = {"tab": "\t"} # REDCap csvDelimiter names
+
+
+def iter_csv_rows(fp, delimiter=",", encoding="utf-8-sig"):
+    """yield rows (header first) of a CSV body read incrementally"""
+    if not hasattr(fp, "read1"):
+        fp = BufferedReader(fp, CHUNK_SIZE)
+    return csv_reader(
+        TextIOWrapper(fp, encoding=encoding, newline=""),
+        delimiter=CSV_DELIMITERS.get(delimiter, delimiter)
+    )
+
+
+def codec(data_type):
+    """return (parse, dump) pair for a validation type, blank-aware"""
+    parse, dump, sql_type = data_type_map.get(data_type, data_type_map[""])
+    if sql_type == "TEXT":
+        return (
+            lambda v: "" if v is None else v,
+            lambda v: "" if v is None else v,
+        )
+    return (
+        lambda v: None if v is None or v == "" else parse(v),
+        lambda v: "" if v is None else dump(v),
+    )
+
+
+def numpy_iso(values, order, width):
+    """return fixed-width date strings reordered into ISO 8601"""
+    chars = values.astype("U{}".format(width)).view("U1").reshape(
+        -1, width
+    )
+    chars = chars[:, ISO_ORDER[order] + list(range(10, width))]
+    if width > 10:
+        chars[:, 10] = "T"
+    return numpy.ascontiguousarray(chars).view(
+        "U{}".format(width)
+    ).ravel()
+
+
+def numpy_cast(raw_values, data_type, scaled=False):
+    """return masked array casting a column of raw strings in one pass"""
+    if numpy is None:
+        raise Exception("numpy is required for vectorized casting")
+    values = numpy.asarray(list(raw_values), dtype=str)
+    mask = values == ""
+    sql_type = data_type_map.get(data_type, data_type_map[""])[2]
+    if sql_type == "INT":
+        values = numpy.where(mask, "0", values).astype(numpy.int64)
+    elif sql_type == "FLOAT":
+        if "comma" in data_type:
+            values = numpy.char.replace(values, ",", ".")
+        values = numpy.where(mask, "0", values)
+        floats = values.astype(numpy.float64)
+        if scaled:
+            digits = data_type.partition("dp")[0].rpartition("_")[2]
+            if digits.isdigit():
+                scale = int(digits)
+            else:
+                dot = numpy.char.find(values, ".")
+                scale = int(numpy.where(
+                    dot >= 0, numpy.char.str_len(values) - dot - 1, 0
+                ).max(initial=0))
+            floats = numpy.rint(floats * 10 ** scale).astype(numpy.int64)
+        values = floats
+    elif sql_type in ("DATE", "DATETIME"):
+        order = data_type.rpartition("_")[2]
+        blank = "2000-01-01" if order == "ymd" else "01-01-2000"
+        if sql_type == "DATE":
+            width, unit = 10, "D"
+        elif "seconds" in data_type:
+            width, unit, blank = 19, "s", blank + " 00:00:00"
+        else:
+            width, unit, blank = 16, "m", blank + " 00:00"
+        values = numpy_iso(
+            numpy.where(mask, blank, values), order, width
+        ).astype("datetime64[{}]".format(unit))
+    elif sql_type == "TIME":
+        chars = numpy.where(mask, "00:00", values).astype("U5").view(
+            "U1"
+        ).reshape(-1, 5)
+        digits = chars[:, [0, 1, 3, 4]].astype(numpy.int64)
+        values = (
+            (digits[:, 0] * 10 + digits[:, 1]) * 60
+            + digits[:, 2] * 10 + digits[:, 3]
+        ).astype("timedelta64[{}]".format(
+            "s" if data_type == "time_mm_ss" else "m"
+        ))
+    return numpy.ma.MaskedArray(values, mask=mask)